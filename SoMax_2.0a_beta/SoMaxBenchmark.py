@@ -0,0 +1,189 @@
+import os, sys
+os.chdir(os.path.dirname(os.path.abspath(__file__))) # SOM tables are loaded relatively to SoMax folder
+sys.path.insert(0, os.getcwd())
+import SoMaxLibrary as sm
+import argparse, gc, glob, json, platform, random, subprocess, timeit
+import numpy as np
+
+###############################################################################
+# SoMaxBenchmark times the influence -> activity -> decide hot path of SoMax.
+#   For every corpus it builds a headless player (OSC output discarded) with a
+#   melodic and a harmonic atom, replays a synthetic influence stream and times
+#   separately Atom.influence, Player.get_merged_activity, the decide function
+#   and Player.new_event. Results are output as JSON, so that runs can be
+#   compared across commits with --compare.
+
+DEFAULT_CORPORA = ["Corpus/CarineIntuition.json"] + sorted(glob.glob("../SoMax_1.45_Max7/corpus/*.json"))
+PROBES = ["influence", "get_merged_activity", "decide", "new_event"]
+
+class HeadlessPlayer(sm.Players.Player):
+    def send(self, content, address=None):
+        pass
+
+
+###############################################################################
+# Probe wraps a callable, and stores latency and allocations of every call.
+#   allocations are counted in memory blocks when the interpreter exposes them
+#   (sys.getallocatedblocks), and in gc-tracked objects otherwise ; both are
+#   net counts, i.e. what the call leaves allocated when it returns. Output
+#   sizes are only recorded by callables wrapped with sized, for the stages
+#   whose output is of variable length.
+
+class Probe(object):
+    if hasattr(sys, "getallocatedblocks"):
+        allocation_unit = "blocks"
+        count_allocations = staticmethod(sys.getallocatedblocks)
+    else:
+        allocation_unit = "gc_objects"
+        count_allocations = staticmethod(lambda: gc.get_count()[0])
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.allocations = []
+        self.sizes = []
+
+    def wrap(self, function):
+        def probed(*args, **kwargs):
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            a = self.count_allocations()
+            t = timeit.default_timer()
+            result = function(*args, **kwargs)
+            self.latencies.append(timeit.default_timer()-t)
+            self.allocations.append(self.count_allocations()-a)
+            if gc_was_enabled:
+                gc.enable()
+            return result
+        return probed
+
+    def sized(self, function):
+        def measured(*args, **kwargs):
+            result = function(*args, **kwargs)
+            self.sizes.append(len(result))
+            return result
+        return measured
+
+    def summary(self):
+        if not self.latencies:
+            return {"calls":0}
+        latencies = np.array(self.latencies)*1000.0
+        summary = {"calls":len(latencies), "mean_ms":float(latencies.mean()), "max_ms":float(latencies.max()), \
+                    "allocations_per_call":float(np.mean(self.allocations)), "allocation_unit":self.allocation_unit}
+        for p in (50, 90, 99):
+            summary["p%d_ms"%p] = float(np.percentile(latencies, p))
+        if self.sizes:
+            summary["mean_output_size"] = float(np.mean(self.sizes))
+        return summary
+
+
+###############################################################################
+# benchmark routines
+
+def build_player(corpus, activity_type, memory_type):
+    scheduler = sm.SoMaxScheduler.SomaxScheduler()
+    scheduler.triggers["bench"] = "automatic"
+    player = HeadlessPlayer("bench", scheduler, 0)
+    player.create_streamview("melodic")
+    player.create_atom("melodic:pitch", label_type="MelodicLabel", activity_type=activity_type, memory_type=memory_type, memory_file=corpus)
+    player.create_streamview("harmonic")
+    player.create_atom("harmonic:chroma", label_type="HarmonicLabel", activity_type=activity_type, memory_type=memory_type, memory_file=corpus)
+    return player
+
+def influence_stream(density, duration, seed):
+    '''yields (date, path, influence) tuples : density influences per beat
+    on each atom, pitches as a random walk and chromas around it.'''
+    rng = random.Random(seed)
+    pitch = 60
+    for i in range(int(density*duration)):
+        date = float(i)/density
+        pitch = min(max(pitch + rng.choice([-5,-3,-2,-1,1,2,3,5]), 36), 96)
+        yield date, "melodic:pitch", "midi {0} 100".format(pitch)
+        chroma = [rng.random()*0.2 for _ in range(12)]
+        for interval in (0, 4, 7):
+            chroma[(pitch+interval)%12] = 1.0
+        yield date, "harmonic:chroma", "chroma "+" ".join(map(str, chroma))
+
+def run_corpus(corpus, args):
+    t = timeit.default_timer()
+    player = build_player(corpus, args.activity_type, args.memory_type)
+    load_time = timeit.default_timer()-t
+    probes = dict((name, Probe(name)) for name in PROBES)
+    # instrumenting the hot path
+    atoms = [player.streamviews[s].atoms[a] for s in player.streamviews for a in player.streamviews[s].atoms]
+    atoms.append(player.current_streamview.atoms["_self"])
+    memory_spaces = dict((id(atom.memorySpace), atom.memorySpace) for atom in atoms)
+    for atom in atoms:
+        atom.influence = probes["influence"].wrap(atom.influence)
+    for memory_space in memory_spaces.values(): # sizes of influence are the numbers of peaks
+        memory_space.influence = probes["influence"].sized(memory_space.influence)
+    player.get_merged_activity = probes["get_merged_activity"].sized(probes["get_merged_activity"].wrap(player.get_merged_activity))
+    player.decide = probes["decide"].wrap(player.decide)
+    new_event = probes["new_event"].wrap(player.new_event)
+
+    peaks = []
+    next_event = 0.0
+    random.seed(args.seed) # decide functions draw from the global generator
+    for date, path, influence in influence_stream(args.density, args.duration, args.seed):
+        player.scheduler.time = date
+        player.influence(path, influence)
+        if date >= next_event:
+            event = new_event(date)
+            next_event = date + 1.0/args.event_rate
+            peaks.append(sum(len(atom.activityPattern.value) for atom in atoms))
+    return {"states":len(player.current_streamview.atoms["_self"].memorySpace), "load_time_s":load_time, \
+            "probes":dict((name, probe.summary()) for name, probe in probes.iteritems()), \
+            "peaks":{"mean":float(np.mean(peaks)) if peaks else 0.0, "max":int(max(peaks)) if peaks else 0}}
+
+def get_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.STDOUT).strip()
+    except Exception:
+        return None
+
+def compare(results, reference):
+    '''prints the ratio of each probe's median latency to the reference run'''
+    for corpus, result in results["corpora"].iteritems():
+        if not corpus in reference["corpora"] or "error" in result or "error" in reference["corpora"][corpus]:
+            continue
+        for name, probe in result["probes"].iteritems():
+            ref = reference["corpora"][corpus]["probes"].get(name, {})
+            if probe.get("calls") and ref.get("calls"):
+                print "{0:40} {1:20} p50 {2:8.3f} ms ({3:5.2f}x)".format(os.path.basename(corpus), name, probe["p50_ms"], probe["p50_ms"]/ref["p50_ms"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the SoMax influence and generation hot path')
+    parser.add_argument('--corpus', metavar='FILE', nargs='+', default=DEFAULT_CORPORA,
+                        help='corpora to benchmark (default: shipped 2.0 and 1.45 corpora)')
+    parser.add_argument('--density', type=float, default=4.0, help='influences per beat on each atom')
+    parser.add_argument('--event-rate', type=float, default=2.0, help='generated events per beat')
+    parser.add_argument('--duration', type=float, default=64.0, help='length of the influence stream in beats')
+    parser.add_argument('--activity-type', default='ClassicActivityPattern', help='activity pattern class of the atoms')
+    parser.add_argument('--memory-type', default='NGramMemorySpace', help='memory space class of the atoms')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', metavar='FILE', help='writes results to FILE instead of stdout')
+    parser.add_argument('--compare', metavar='FILE', help='previous results to compare with')
+    args = parser.parse_args()
+
+    results = {"revision":get_revision(), "python":platform.python_version(), "numpy":np.__version__, \
+                "settings":{"density":args.density, "event_rate":args.event_rate, "duration":args.duration, \
+                            "activity_type":args.activity_type, "memory_type":args.memory_type, "seed":args.seed}, \
+                "corpora":dict()}
+    for corpus in args.corpus:
+        print >> sys.stderr, "[INFO] benchmarking", corpus
+        try:
+            results["corpora"][corpus] = run_corpus(corpus, args)
+        except Exception as e:
+            # a corpus failing to load or to play does not stop the run
+            print >> sys.stderr, "[ERROR] benchmark of", corpus, "failed :", e
+            results["corpora"][corpus] = {"error":"{0}: {1}".format(type(e).__name__, e)}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        print json.dumps(results, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -1,17 +1,18 @@
-
+import threading
 import numpy as np
-from bisect import bisect_left
-from copy import deepcopy
 from Tools import SequencedList
 
+# The state of an activity pattern is published as an immutable snapshot
+#   (date, zeta, value, transform). Writers build new arrays and replace the
+#   snapshot in a single assignment, serialized by a writer lock ; readers
+#   take the current snapshot without locking and never see a half-updated
+#   pattern, so that influences and generation can run on separate threads.
+
 class AbstractActivityPattern(object):
 
     def __init__(self, date=0.0):
-        self.zeta = np.array([], dtype=np.dtype(float)) # list of activity peaks dates
-        self.value = np.array([], dtype=np.dtype(float)) # list of activity peaks heights
-        self.transform = []
-        self.date = date # current time of the activity state
-        self.available = True
+        self.lock = threading.RLock() # only taken by writers
+        self.publish(date, np.array([], dtype=np.dtype(float)), np.array([], dtype=np.dtype(float)), np.array([], dtype=int))
 
     def __repr__(self):
         return reduce(lambda x, y: x+"{0} at {1}".format(str(y[0]), str(y[1])), zip(self.zeta, self.value), "")
@@ -19,13 +20,32 @@ class AbstractActivityPattern(object):
     def __desc__(self):
         return "Abstract Activity Pattern"
 
+    def publish(self, date, zeta, value, transform):
+        '''replaces the current snapshot. published arrays are frozen.'''
+        for array in (zeta, value, transform):
+            array.flags.writeable = False
+        self.snapshot = (date, zeta, value, transform)
+
+    # read-only accessors on the current snapshot
+    @property
+    def date(self):
+        return self.snapshot[0] # current time of the activity state
+    @property
+    def zeta(self):
+        return self.snapshot[1] # list of activity peaks dates
+    @property
+    def value(self):
+        return self.snapshot[2] # list of activity peaks heights
+    @property
+    def transform(self):
+        return self.snapshot[3] # list of activity peaks transform IDs
+
     def insert(self,z,a,t):
         print "Inserts activity peaks as sets (location, value, transform)"
 
     def get_activity(self, time=None):
-        if time==None:
-            time = int(self.date)
-        return self.zeta, self.value, self.transform
+        date, zeta, value, transform = self.snapshot
+        return zeta, value, transform
         #print "returns activity"
 
     def update_activity(self, new_date):
@@ -34,18 +54,18 @@ class AbstractActivityPattern(object):
     def clean_up(self):
         print "Cleans activities profile below extinction thresold"
 
+    def isAvailable(self):
+        return True # readers never wait for writers
+
     def reset(self, time):
-        self.zeta = np.array([], dtype=np.dtype(float)) # list of activity peaks dates
-        self.value = np.array([], dtype=np.dtype(float)) # list of activity peaks heights
-        self.transform = []
-        self.time = time
+        with self.lock:
+            self.publish(time, np.array([], dtype=np.dtype(float)), np.array([], dtype=np.dtype(float)), np.array([], dtype=int))
 
 
 class ClassicActivityPattern(AbstractActivityPattern):
     tau_mem_decay = 2.0
     t_width = 0.1
     extinction_threshold = 0.1
-    available = 1
 
     def __init__(self, date=0.0):
         super(ClassicActivityPattern, self).__init__(date)
@@ -55,44 +75,150 @@ class ClassicActivityPattern(AbstractActivityPattern):
     def insert(self, *args):
         for peak in args:
             assert type(peak) is tuple and len(peak)==3, "peak insertion failed!"
-            zeta, value, transform = peak
-            i = bisect_left(self.zeta, zeta)
-            self.zeta = np.insert(self.zeta, i, zeta)
-            self.value = np.insert(self.value, i, value)
-            self.transform.insert(i,transform)
+        if len(args)==0:
+            return
+        zetas, values, transforms = zip(*args)
+        self.insert_peaks(zetas, values, transforms)
+
+    def insert_peaks(self, zetas, values, transforms):
+        '''bulk insertion : new peaks are sorted once and merged into the
+        current arrays with a single reallocation'''
+        zetas = np.asarray(zetas, dtype=float)
+        order = np.argsort(zetas, kind='mergesort')
+        zetas = zetas[order]
+        values = np.asarray(values, dtype=float)[order]
+        transforms = np.asarray(transforms, dtype=int)[order]
+        with self.lock:
+            date, zeta, value, transform = self.snapshot
+            positions = np.searchsorted(zeta, zetas, side='left')
+            self.publish(date, np.insert(zeta, positions, zetas), np.insert(value, positions, values), np.insert(transform, positions, transforms))
 
     def update_activity(self, new_date):
-        if self.available:
-            self.available = 0
-            self.zeta += new_date - self.date
-            self.value *= np.exp(-np.divide(new_date - self.date, self.tau_mem_decay))
-            self.date = new_date
-            self.zeta, self.value, self.transform=self.clean_up(self.zeta, self.value, self.transform)
-            self.available = 1
+        with self.lock:
+            date, zeta, value, transform = self.snapshot
+            zeta = zeta + (new_date - date)
+            value = value * np.exp(-np.divide(new_date - date, self.tau_mem_decay))
+            zeta, value, transform = self.clean_up(zeta, value, transform)
+            self.publish(new_date, zeta, value, transform)
 
     def clean_up(self, zeta, value, transform):
-        cond_tmp = value < self.extinction_threshold
-        itmp = cond_tmp.nonzero()
-        zeta = np.delete(zeta,itmp)
-        value = np.delete(value,itmp)
-        transform_tmp = deepcopy(transform)
-        for i in reversed(sorted(itmp[0].tolist())):
-            del transform_tmp[i]
-        return zeta, value, transform_tmp
+        alive = value >= self.extinction_threshold
+        return zeta[alive], value[alive], transform[alive]
 
     def get_activity(self, date=None):
+        ref_date, zeta, value, transform = self.snapshot
         if date==None:
-            date = int(self.date)
-        if self.available:
-            self.available = 0
-            ztmp = np.array(self.zeta)
-            vtmp = np.array(self.value)
-            ttmp = deepcopy(self.transform)
-            self.available = 1
-            ztmp+=date - self.date
-            vtmp *= np.exp(-np.divide(date - self.date, self.tau_mem_decay))
-            ztmp, vtmp, ttmp =  self.clean_up(ztmp, vtmp, ttmp)
-            return SequencedList(list(ztmp), list(zip(vtmp, ttmp)))
-
-        else:
-            return np.array([]), np.array([]), np.arra
+            date = int(ref_date)
+        ztmp = zeta + (date - ref_date)
+        vtmp = value * np.exp(-np.divide(date - ref_date, self.tau_mem_decay))
+        ztmp, vtmp, ttmp =  self.clean_up(ztmp, vtmp, transform)
+        return SequencedList(ztmp, zip(vtmp.tolist(), ttmp.tolist()))
+
+
+class LazyActivityPattern(ClassicActivityPattern):
+    '''Activity pattern whose peaks are stored relative to a reference date.
+    Shift and decay are computed in closed form when the activity is read,
+    without copying the stored peaks ; extinct peaks are pruned when new peaks
+    are merged in, or on read once more than prune_threshold are left, up to
+    the insertion date.'''
+    prune_threshold = 64
+
+    def __init__(self, date=0.0):
+        super(LazyActivityPattern, self).__init__(date)
+        self.insertion_date = date
+
+    def __desc__(self):
+        return "Lazy Activity Pattern"
+
+    def update_activity(self, new_date):
+        # stored peaks are only moved to the new date when peaks are inserted
+        self.insertion_date = new_date
+
+    def insert_peaks(self, zetas, values, transforms):
+        with self.lock:
+            self.rebase(self.insertion_date)
+            super(LazyActivityPattern, self).insert_peaks(zetas, values, transforms)
+
+    def rebase(self, date):
+        '''moves the reference date of the stored peaks and prunes extinct ones'''
+        with self.lock:
+            ref_date, zeta, value, transform = self.snapshot
+            dt = date - ref_date
+            value = value*np.exp(-dt/self.tau_mem_decay)
+            alive = value >= self.extinction_threshold
+            self.publish(date, zeta[alive] + dt, value[alive], transform[alive])
+
+    def get_activity(self, date=None):
+        ref_date, zeta, value, transform = self.snapshot
+        if date==None:
+            date = int(ref_date)
+        dt = date - ref_date
+        value = value*np.exp(-dt/self.tau_mem_decay)
+        alive = value >= self.extinction_threshold
+        zeta = zeta[alive]
+        zeta += dt
+        activity = SequencedList(zeta, zip(value[alive].tolist(), transform[alive].tolist()))
+        # pruning is skipped rather than waited for if a writer is busy. peaks
+        #   are not pruned after the insertion date, as earlier reads and next
+        #   insertions still see the ones alive until then
+        prune_date = min(date, self.insertion_date)
+        if prune_date > ref_date and len(alive)-len(zeta) > self.prune_threshold and self.lock.acquire(False):
+            try:
+                self.rebase(prune_date)
+            finally:
+                self.lock.release()
+        return activity
+
+    def reset(self, time):
+        with self.lock:
+            super(LazyActivityPattern, self).reset(time)
+            self.insertion_date = time
+
+
+class BoundedActivityPattern(LazyActivityPattern):
+    '''Lazy activity pattern with a peak budget : after each insertion only
+    the max_peaks strongest peaks are kept, bounding the cost of every merge
+    and decision step. The number of discarded peaks is kept in dropped_peaks.'''
+    max_peaks = 256
+
+    def __init__(self, date=0.0):
+        super(BoundedActivityPattern, self).__init__(date)
+        self.dropped_peaks = 0
+
+    def __desc__(self):
+        return "Bounded Activity Pattern"
+
+    def set_max_peaks(self, max_peaks):
+        try:
+            self.max_peaks = int(max_peaks)
+        except:
+            print("[ERROR] activity peak budget must be an integer")
+            return
+        self.select(self.max_peaks)
+
+    def insert_peaks(self, zetas, values, transforms):
+        with self.lock:
+            super(BoundedActivityPattern, self).insert_peaks(zetas, values, transforms)
+            self.select(self.max_peaks)
+
+    def select(self, k):
+        '''keeps the k strongest peaks, preserving their temporal order'''
+        with self.lock:
+            date, zeta, value, transform = self.snapshot
+            n = len(value)
+            if n <= k:
+                return
+            # stored values share the same decay factor, so their ranking is valid at any date
+            keep = np.zeros(n, dtype=bool)
+            if k > 0:
+                keep[np.argpartition(value, n-k)[n-k:]] = True
+            self.publish(date, zeta[keep], value[keep], transform[keep])
+            self.dropped_peaks += n-k
+
+    def get_metrics(self):
+        return {"peaks":len(self.value), "dropped_peaks":self.dropped_peaks, "max_peaks":self.max_peaks}
+
+    def reset(self, time):
+        with self.lock:
+            super(BoundedActivityPattern, self).reset(time)
+            self.dropped_peaks = 0
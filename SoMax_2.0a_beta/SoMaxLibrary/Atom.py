@@ -35,14 +35,19 @@ class Atom(object):
         if memory_type!=None:
             # if different memory type, create a new memory space
             memory_class = getattr(MemorySpaces, memory_type)
-            self.memorySpace = memory_class(label_type = label_type, contents_type = contents_type, event_type = event_type)
-        # read file
+            self.memory_type = memory_class
+            memory_space = memory_class(label_type = label_type, contents_type = contents_type, event_type = event_type)
+        else:
+            memory_space = self.memorySpace.empty_copy()
+        # read file in a fresh memory space, so that the current one stays
+        #   usable by other threads until the new one is published
         print "[INFO] reading file", filez, "..."
-        success = self.memorySpace.read(filez)
-        if success == False:
+        memory_space = MemorySpaces.pool.read(memory_space, filez)
+        if memory_space is None:
             raise Exception("[ERROR] failed to load the file ", filez)
         else:
             print "[INFO] file {0} loaded".format(filez)
+        self.memorySpace = memory_space
         # set current file
         self.current_file = filez
 
@@ -54,8 +59,9 @@ class Atom(object):
     def influence(self,time,*data,**kwargs):
         peaks = self.memorySpace.influence(data, **kwargs) # we get the activity peaks created by influence
         if peaks!=[]:
-            self.activityPattern.update_activity(time) # we update the activity profile to the current time
-            self.activityPattern.insert(*peaks) # we insert the peaks into the activity profile
+            with self.activityPattern.lock:
+                self.activityPattern.update_activity(time) # we update the activity profile to the current time
+                self.activityPattern.insert(*peaks) # we insert the peaks into the activity profile
 
 
     # external method to get back atom's activity
@@ -77,7 +83,7 @@ class Atom(object):
         atom =  Atom(name=name, weight = self.weight, \
                         label_type = self.memorySpace.label_type, contents_type=self.memorySpace.contents_type, event_type=self.memorySpace.event_type, \
                         activity_type = self.activity_type, memory_type = self.memory_type)
-        atom.memorySpace = self.memory_type(self.memorySpace.get_dates_list(), self.memorySpace.get_events_list(),label_type = self.memorySpace.label_type, contents_type=self.memorySpace.contents_type, event_type=self.memorySpace.event_type)
+        atom.memorySpace = self.memorySpace.share()
         atom.current_file = self.current_file
         return atom
 
@@ -86,6 +92,10 @@ class Atom(object):
         infodict= {"activity":self.activityPattern.__desc__(), "memory":self.memorySpace.__desc__(), \
                     "event_type":self.memorySpace.event_type.__desc__(), "label_type":self.memorySpace.label_type.__desc__(), \
                     "contents_type":self.memorySpace.contents_type.__desc__(), "name":self.name, "weight":self.weight, "type":"Atom", "active":self.active}
+        if hasattr(self.activityPattern, "get_metrics"):
+            infodict["activity_metrics"] = self.activityPattern.get_metrics()
+        if hasattr(self.memorySpace, "get_metrics"):
+            infodict["memory_metrics"] = self.memorySpace.get_metrics()
         if self.current_file!=None:
             infodict["current_file"]=str(self.current_file)
             infodict["length"]=len(self.memorySpace)
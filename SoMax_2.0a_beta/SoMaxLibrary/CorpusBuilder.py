@@ -412,3 +412,179 @@ def computePitchClassVector(noteMatrix, tStep = 20.0, thresh=0.05, m_onset=0.5,
 		ind_pc = k % 12
 		mVector[ind_pc, :] = mVector[ind_pc, :] + pVector[k,:]
 	return mVector, tRef
+
+
+# SoMax 1.45 corpora store [onset, duration] lists in milliseconds, the beat
+# position and tempo in "beat", the label in "slice" and the chroma in "extras"
+def is_legacy_corpus(corpus):
+	return len(corpus["data"])>1 and type(corpus["data"][1]["time"])==list
+
+# pitch of a SoMax 1.45 state. "slice" holds a pitch class in _m corpora and
+# chord labels above 127 in others, so the pitch is taken from the notes : the
+# first note starting in the state, or else the first held note, 140 being
+# silence as in build_corpus
+def get_legacy_pitch(state):
+	notes = [note for note in state["notes"] if note["time"][0]>=0] or state["notes"]
+	return int(notes[0]["note"][0]) if notes else 140
+
+# converts a SoMax 1.45 corpus into the layout written by CorpusBuilder.
+# some 1.45 corpora hold states of negative duration, followed by states
+# starting before them : these are dropped, so that onsets are ordered
+def convert_legacy_corpus(corpus):
+	data = []
+	for state in corpus["data"]:
+		if data and (state["time"][1]<0 or state["time"][0]<data[-1]["time"]["absolute"][0] \
+				or state["beat"][0]<data[-1]["time"]["relative"][0]):
+			continue
+		tempo = float(state["beat"][1]) if state["beat"][1]>0 else 120.0
+		ms_to_beats = tempo/60000.0
+		onset, duration = state["time"]
+		new_state = {"state": state["state"], "tempo": tempo, "seg": state["seg"], "beat": state["beat"], \
+					"time": {"absolute": [float(onset), float(duration)], "relative": [float(state["beat"][0]), duration*ms_to_beats]}, \
+					"pitch": get_legacy_pitch(state), "chroma": state["extras"], "notes": []}
+		for note in state["notes"]:
+			pitch, velocity, channel = note["note"]
+			offset, length = note["time"]
+			new_state["notes"].append({"pitch": float(pitch), "velocity": float(velocity), "channel": float(channel), \
+					"time": {"absolute": [float(offset), float(length)], "relative": [offset*ms_to_beats, length*ms_to_beats]}})
+		data.append(new_state)
+	return {"typeID": corpus["typeID"], "name": corpus.get("name"), "data": data}
+
+
+# compiled corpora store the fields used by SoMax as columns in a .npz file :
+# one row per state for times, tempo, pitch and chroma, one row per note in
+# the note table, and the n-gram indexes of melodic and harmonic labels for
+# every order up to max_ngram. the first (initial) state of the JSON layout
+# is not stored.
+COMPILED_VERSION = 2
+
+def compile_corpus(corpus, path, max_ngram=6):
+	import Events
+	columns = get_corpus_columns(corpus)
+	columns["max_ngram"] = max_ngram
+	# label keys, as given by MelodicLabel and HarmonicLabel get_key
+	columns["harmonic"] = Events.som_classifier.classify_batch(columns["chroma"])
+	for key in ["pitch", "harmonic"]:
+		for order in range(1, max_ngram+1):
+			columns.update(pack_index(build_index(columns[key], order), "index_"+key+"_"+str(order), order))
+	numpy.savez(path, **columns)
+	validate_compiled_corpus(load_compiled_corpus(path), corpus)
+	return path
+
+# columns of the states of a corpus, without label keys nor indexes
+def get_corpus_columns(corpus):
+	if is_legacy_corpus(corpus):
+		corpus = convert_legacy_corpus(corpus)
+	states = corpus["data"][1:]
+	# state index, pitch, velocity, channel, onsets and durations of every note
+	notes = get_matrix(((i, note["pitch"], note["velocity"], note["channel"], note["time"]["relative"][0], note["time"]["absolute"][0], \
+			note["time"]["relative"][1], note["time"]["absolute"][1]) for i, state in enumerate(states) for note in state["notes"]), 8)
+	columns = {"version": COMPILED_VERSION, "typeID": corpus["typeID"], "name": corpus.get("name") or "", "max_ngram": 0, \
+			"state": array([state["state"] for state in states], dtype=int).reshape(-1), \
+			"onset": get_matrix(((state["time"]["relative"][0], state["time"]["absolute"][0]) for state in states), 2), \
+			"duration": get_matrix(((state["time"]["relative"][1], state["time"]["absolute"][1]) for state in states), 2), \
+			"tempo": array([state["tempo"] for state in states], dtype=float).reshape(-1), \
+			"pitch": array([state["pitch"] for state in states], dtype=int).reshape(-1), \
+			"chroma": get_matrix((state["chroma"] for state in states), 12), \
+			"note_state": notes[:, 0].astype(int), "note_pitch": notes[:, 1].copy(), "note_velocity": notes[:, 2].copy(), \
+			"note_channel": notes[:, 3].copy(), "note_onset": notes[:, 4:6].copy(), "note_duration": notes[:, 6:8].copy()}
+	return columns
+
+# float matrix of rows of width values, without building an array per row
+def get_matrix(rows, width):
+	return numpy.fromiter(itertools.chain.from_iterable(rows), dtype=float).reshape(-1, width)
+
+def load_compiled_corpus(path):
+	with numpy.load(path) as archive:
+		corpus = dict((key, archive[key]) for key in archive.files)
+	if int(corpus["version"])!=COMPILED_VERSION:
+		raise IOError("compiled corpus "+path+" has version "+str(corpus["version"])+", expected "+str(COMPILED_VERSION))
+	for key in ["typeID", "name"]:
+		corpus[key] = str(corpus[key])
+	corpus["max_ngram"] = int(corpus["max_ngram"])
+	corpus["note_bounds"] = get_note_bounds(corpus)
+	return corpus
+
+# notes of state i are note_bounds[i]:note_bounds[i+1], notes being sorted by state
+def get_note_bounds(corpus):
+	return numpy.searchsorted(corpus["note_state"], numpy.arange(len(corpus["state"])+1))
+
+# rebuilds the state dictionary of the JSON layout of state i from compiled columns
+def get_compiled_state(corpus, i):
+	onset, duration = corpus["onset"][i].tolist(), corpus["duration"][i].tolist()
+	state = {"state": corpus["state"][i].item(), "tempo": corpus["tempo"][i].item(), "pitch": corpus["pitch"][i].item(), \
+			"chroma": corpus["chroma"][i].tolist(), "notes": [], \
+			"time": {"relative": [onset[0], duration[0]], "absolute": [onset[1], duration[1]]}}
+	a, b = corpus["note_bounds"][i:i+2].tolist()
+	note_onset, note_duration = corpus["note_onset"][a:b].tolist(), corpus["note_duration"][a:b].tolist()
+	for j, (p, v, c) in enumerate(itertools.izip(corpus["note_pitch"][a:b].tolist(), corpus["note_velocity"][a:b].tolist(), \
+			corpus["note_channel"][a:b].tolist())):
+		state["notes"].append({"pitch": p, "velocity": v, "channel": c, \
+			"time": {"relative": [note_onset[j][0], note_duration[j][0]], "absolute": [note_onset[j][1], note_duration[j][1]]}})
+	return state
+
+# rebuilds the state dictionaries of the JSON layout from compiled columns
+def get_compiled_states(corpus):
+	onset, duration, tempo = corpus["onset"].tolist(), corpus["duration"].tolist(), corpus["tempo"].tolist()
+	pitch, chroma, number = corpus["pitch"].tolist(), corpus["chroma"].tolist(), corpus["state"].tolist()
+	states = [{"state": number[i], "tempo": tempo[i], "pitch": pitch[i], "chroma": chroma[i], "notes": [], \
+			"time": {"relative": [onset[i][0], duration[i][0]], "absolute": [onset[i][1], duration[i][1]]}} for i in xrange(len(tempo))]
+	note_onset, note_duration = corpus["note_onset"].tolist(), corpus["note_duration"].tolist()
+	for j, (i, p, v, c) in enumerate(itertools.izip(corpus["note_state"].tolist(), corpus["note_pitch"].tolist(), \
+			corpus["note_velocity"].tolist(), corpus["note_channel"].tolist())):
+		states[i]["notes"].append({"pitch": p, "velocity": v, "channel": c, \
+			"time": {"relative": [note_onset[j][0], note_duration[j][0]], "absolute": [note_onset[j][1], note_duration[j][1]]}})
+	return states
+
+def validate_compiled_corpus(compiled, corpus):
+	if is_legacy_corpus(corpus):
+		corpus = convert_legacy_corpus(corpus)
+	if compiled["typeID"]!=corpus["typeID"]:
+		raise ValueError("compiled corpus has type "+compiled["typeID"]+" instead of "+corpus["typeID"])
+	states = get_compiled_states(compiled)
+	if len(states)!=len(corpus["data"])-1:
+		raise ValueError("compiled corpus has "+str(len(states))+" states instead of "+str(len(corpus["data"])-1))
+	for i, (state, original) in enumerate(zip(states, corpus["data"][1:])):
+		values = [state["state"], state["tempo"], state["pitch"]] + state["time"]["relative"] + state["time"]["absolute"] + state["chroma"]
+		expected = [original["state"], original["tempo"], original["pitch"]] + original["time"]["relative"] + original["time"]["absolute"] + original["chroma"]
+		if len(state["notes"])!=len(original["notes"]):
+			raise ValueError("notes of state "+str(i+1)+" differ from the source corpus")
+		for note, original_note in zip(state["notes"], original["notes"]):
+			values += [note["pitch"], note["velocity"], note["channel"]] + note["time"]["relative"] + note["time"]["absolute"]
+			expected += [original_note["pitch"], original_note["velocity"], original_note["channel"]] + original_note["time"]["relative"] + original_note["time"]["absolute"]
+		if len(values)!=len(expected) or not numpy.allclose(values, expected, rtol=0, atol=1e-9):
+			raise ValueError("state "+str(i+1)+" differs from the source corpus")
+	return True
+
+# n-gram index of a key column : {(key_1, ..., key_n): [indices of the states ending the n-gram]}
+def build_index(keys, ngram_size):
+	index = dict()
+	keys = keys.tolist()
+	for i in xrange(ngram_size-1, len(keys)):
+		seq = tuple(keys[i+1-ngram_size:i+1])
+		try:
+			index[seq].append(i)
+		except KeyError:
+			index[seq] = [i]
+	return index
+
+# stores an index as a key matrix, and state lists concatenated with their boundaries
+def pack_index(index, prefix, ngram_size):
+	seqs = sorted(index.keys())
+	states = [index[seq] for seq in seqs]
+	return {prefix+"_keys": array(seqs, dtype=int).reshape(len(seqs), ngram_size), \
+			prefix+"_bounds": numpy.cumsum([0]+map(len, states)), \
+			prefix+"_states": array(list(itertools.chain(*states)), dtype=int)}
+
+def unpack_index(corpus, prefix):
+	seqs, bounds, states = corpus[prefix+"_keys"].tolist(), corpus[prefix+"_bounds"].tolist(), corpus[prefix+"_states"].tolist()
+	return dict((tuple(seq), states[bounds[i]:bounds[i+1]]) for i, seq in enumerate(seqs))
+
+
+if __name__=="__main__":
+	import sys
+	# compiles the given JSON corpora next to their source
+	for path in sys.argv[1:]:
+		with open(path) as f:
+			corpus = json.load(f)
+		print "[INFO] compiled", compile_corpus(corpus, os.path.splitext(path)[0]+".npz")
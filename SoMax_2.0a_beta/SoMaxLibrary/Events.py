@@ -1,16 +1,101 @@
-import os
+import os, threading, json
 import numpy as np
-from copy import deepcopy, copy
+from copy import deepcopy
 import Transforms
+from Tools import LRUCache
+
+###############################################################################
+# ValueObject is the base of labels, contents and events, that are immutable :
+#   their attributes are only set by their constructor (with _set), so that
+#   they are shared between memory spaces, players and transforms instead of
+#   being copied ; modified objects are built with replace(). they are slotted
+#   to keep events small. their numpy arrays are made read-only as well.
+#   subclasses written for mutable objects keep working by setting
+#   mutable = True : their attributes can be assigned, and copy and deepcopy
+#   copy them as before.
+
+class ValueObject(object):
+    __slots__ = ()
+    mutable = False
+
+    def __setattr__(self, name, value):
+        if not self.mutable:
+            raise AttributeError(type(self).__name__+" objects are immutable, use replace() to modify "+name)
+        object.__setattr__(self, name, value)
+
+    def _set(self, name, value):
+        '''sets an attribute while the object is built'''
+        object.__setattr__(self, name, value)
+
+    def _set_array(self, name, array):
+        '''sets an array attribute while the object is built, read-only
+        unless the object is mutable'''
+        if not self.mutable:
+            array.flags.writeable = False
+        object.__setattr__(self, name, array)
+
+    def get_attributes(self):
+        attributes = dict()
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if hasattr(self, name):
+                    attributes[name] = getattr(self, name)
+        attributes.update(getattr(self, '__dict__', {}))
+        return attributes
+
+    def replace(self, **attributes):
+        '''returns a copy of the object, with the given attributes replaced.
+        arrays given are made read-only, as the ones the object is built with.'''
+        new = object.__new__(type(self))
+        values = self.get_attributes()
+        values.update(attributes)
+        for name, value in values.iteritems():
+            if isinstance(value, np.ndarray):
+                new._set_array(name, value)
+            else:
+                object.__setattr__(new, name, value)
+        return new
+
+    def __copy__(self):
+        return self.replace() if self.mutable else self
+
+    def __deepcopy__(self, memo):
+        if not self.mutable:
+            return self
+        return self.replace(**dict((name, deepcopy(value, memo)) for name, value in self.get_attributes().iteritems()))
+
+    def __getstate__(self):
+        return self.get_attributes()
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            if isinstance(value, np.ndarray):
+                self._set_array(name, value)
+            else:
+                object.__setattr__(self, name, value)
+
+
+def get_hashable_key(value):
+    '''value itself if hashable, its canonical JSON representation otherwise
+    (labels of raw states are dictionaries)'''
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return json.dumps(value, sort_keys=True, default=repr)
+
 
 ###############################################################################
 # AbstractLabel is the abstract pattern for a SoMax Label.
 #   it defines mandatory functions that the label subclasses must handle
 
 
-class AbstractLabel(object):
+class AbstractLabel(ValueObject):
+    __slots__ = ('label',)
+    transposable = False # keys of transposable labels are shifted by TransposeTransform
+    mod12 = False
+    compiled_key = None # column of compiled corpora holding the label keys
     def __init__(self, label=None):
-        self.available_transforms = self.get_available_transforms()
         if not label is None and label!=[]:
             self.set_label(label)
 
@@ -22,11 +107,44 @@ class AbstractLabel(object):
         return "Abstract label"
 
     def set_label(self, label):
-        self.label = deepcopy(label)
+        '''sets the label while the object is built'''
+        self._set('label', label)
 
     def get_label(self):
         '''accessors for label'''
-        return copy(self.label)
+        return self.label
+
+    @property
+    def available_transforms(self):
+        return self.get_available_transforms()
+
+    def get_key(self):
+        '''canonical hashable key of the label, equal for equal labels'''
+        return get_hashable_key(self.label)
+
+    @classmethod
+    def get_label_from_key(cls, key, chroma=None):
+        '''class method constructing a label from its key, as stored in compiled corpora'''
+        return cls(key)
+
+    @classmethod
+    def get_keys_from_data(cls, data):
+        '''class method returning the keys of the labels of a list of raw data'''
+        return [cls.get_label_from_data(d).get_key() for d in data]
+
+    @classmethod
+    def get_values(cls, labels):
+        '''class method returning the array of values of a list of labels, as
+        transformed by the batch functions of Transforms'''
+        values = np.empty(len(labels), dtype=object) # labels may be sequences
+        for i, label in enumerate(labels):
+            values[i] = label.label
+        return values
+
+    @classmethod
+    def get_keys_from_values(cls, values, mod12=False):
+        '''class method returning the keys of the labels of an array of values'''
+        return [get_hashable_key(value) for value in values]
 
     # custom equality function for customized comparison
     def __eq__(self, a):
@@ -49,9 +167,12 @@ class AbstractLabel(object):
 
 class MelodicLabel(AbstractLabel):
     '''Label object carrying pitch information. Can be set octave (in)dependant with mod12 attribute.'''
+    __slots__ = ('mod12',)
+    transposable = True
+    compiled_key = "pitch"
     def __init__(self, label=-1, mod12 = False):
         AbstractLabel.__init__(self, label)
-        self.mod12 = mod12 # is equality dependant of the octave
+        self._set('mod12', mod12) # is equality dependant of the octave
 
     def __repr__(self):
         return "Melodic Label with pitch "+str(self.label)
@@ -62,7 +183,7 @@ class MelodicLabel(AbstractLabel):
 
     def set_label(self, label):
         try:
-            self.label = int(label)
+            self._set('label', int(label))
         except:
             raise TypeError("Failed creating Melodic Label from ", label)
 
@@ -90,6 +211,13 @@ class MelodicLabel(AbstractLabel):
         else:
             raise TypeError("Failed comparing Melodic Label with ", a.__repr__())
 
+    def get_key(self):
+        return self.label%12 if self.mod12 else self.label
+
+    @classmethod
+    def get_keys_from_values(cls, values, mod12=False):
+        return (values%12 if mod12 else values).tolist()
+
     def get_available_transforms(self):
         return [Transforms.NoTransform, Transforms.TransposeTransform]
 
@@ -104,7 +232,7 @@ class MelodicLabel(AbstractLabel):
             label = cls.get_label_from_data(data.get_label(), mod12)
         elif issubclass(type(data), AbstractLabel):
             if issubclass(type(data), MelodicLabel):
-                label = deepcopy(data)
+                label = data
             else:
                 # try to make object from label's label
                 label = cls.get_label_from_data(data.get_label(), mod12)
@@ -114,14 +242,14 @@ class MelodicLabel(AbstractLabel):
             if influence_type=='midi':
                 try:
                     note = int(float(data[1]))
-                    label = cls(note)
+                    label = cls(note, mod12)
                 except:
                     raise Exception("midi pitch identifier must be an integer")
             # classic pitch, [[0, 140], vel, channel
             elif influence_type=='pitch':
                 note = int(data[1])
                 if type(note)==int:
-                    label = cls(data[1])
+                    label = cls(data[1], mod12)
                 else:
                     raise Exception("pitch identifier must be an integer")
             else:
@@ -132,22 +260,72 @@ class MelodicLabel(AbstractLabel):
             label = cls(data["pitch"], mod12)
         if label is None:
             raise Exception("MelodicLabel can't make label from data ",data)
-        label.mod12 = mod12
+        if label.mod12!=mod12:
+            label = label.replace(mod12=mod12)
+        return label
+
+###############################################################################
+# SOMClassifier gives the class of the node of the harmonic SOM closest to a
+#   chroma. SOM tables are loaded once, on first use, from the tables folder of
+#   SoMax. chromas of a corpus are classified in batch, with one matrix product
+#   against the SOM nodes ; single chromas of influences go through a LRU cache
+#   keyed on the chroma quantized to resolution.
+
+class SOMClassifier(object):
+    tables_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tables')
+    batch_size = 256 # chromas classified per matrix product, bounding memory
+    def __init__(self, nodes_file='misc_hsom', classes_file='misc_hsom_c', cache_size=4096, resolution=0.01):
+        self.nodes_file = nodes_file
+        self.classes_file = classes_file
+        self.resolution = resolution
+        self.nodes = None
+        self.classes = None
+        self.cache = LRUCache(cache_size)
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.nodes is None:
+                nodes = np.loadtxt(os.path.join(self.tables_path, self.nodes_file), dtype=float, delimiter=",")
+                self.classes = np.loadtxt(os.path.join(self.tables_path, self.classes_file), dtype=int, delimiter=",")
+                self.norms = np.sum(nodes**2, axis=1)
+                self.nodes = nodes
+
+    def classify_batch(self, chromas):
+        '''SOM classes of a (n x 12) array of chromas'''
+        if self.nodes is None:
+            self.load()
+        # chromas of labels are float32
+        chromas = np.asarray(chromas, dtype='float32').astype(float).reshape(-1, 12)
+        classes = np.empty(len(chromas), dtype=int)
+        for i in xrange(0, len(chromas), self.batch_size):
+            # closest node : squared distances, up to the norm of the chroma
+            distances = self.norms - 2*np.dot(chromas[i:i+self.batch_size], self.nodes.T)
+            classes[i:i+self.batch_size] = self.classes[np.argmin(distances, axis=1)]
+        return classes
+
+    def classify(self, chroma):
+        '''SOM class of a single chroma, cached'''
+        key = tuple(np.round(np.asarray(chroma, dtype=float)/self.resolution).astype(int).tolist())
+        label = self.cache.get(key)
+        if label is None:
+            label = int(self.classify_batch(chroma)[0])
+            self.cache.put(key, label)
         return label
 
+som_classifier = SOMClassifier()
+
+
 class HarmonicLabel(AbstractLabel):
     '''Label object carrying harmonic information.'''
-    node_specificity = 2.0
-    som = [];
-    som_c = [];
+    __slots__ = ('chroma',)
+    compiled_key = "harmonic"
+    classifier = som_classifier
     # an harmonic label contains both chroma and label information
-    def __init__(self, label=None):
-        # importing SOM parameters
-        if HarmonicLabel.som == []:
-            HarmonicLabel.som = np.loadtxt('tables/misc_hsom', dtype=float, delimiter=",")
-        if HarmonicLabel.som_c == []:
-            HarmonicLabel.som_c = np.loadtxt('tables/misc_hsom_c', dtype=int, delimiter=",")
+    def __init__(self, label=None, chroma=None):
         AbstractLabel.__init__(self, label)
+        if not chroma is None:
+            self._set_array('chroma', np.array(chroma, dtype='float32'))
 
     def __repr__(self):
         return "Harmonic Label with label "+str(self.label)
@@ -162,15 +340,13 @@ class HarmonicLabel(AbstractLabel):
     def set_label(self, data):
         if type(data)==list or type(data)==type(np.array(0)):
             # initialized with chroma information
-            self.chroma = np.array(data, dtype='float32')
-            clust_vec = np.exp(-self.node_specificity*np.sqrt(np.sum(np.power(self.chroma-HarmonicLabel.som,2), axis=1)))
-            indtmp = np.argsort(clust_vec)
+            self._set_array('chroma', np.array(data, dtype='float32'))
             # pick corresponding SOM class from chroma information
-            self.label = HarmonicLabel.som_c[indtmp[-1]]
+            self._set('label', self.classifier.classify(self.chroma))
         else:
             try:
-                self.label = int(data)
-                self.chroma = np.zeros(12)
+                self._set('label', int(data))
+                self._set_array('chroma', np.zeros(12))
             except:
                 raise TypeError("Failed to make chromatic label from label ", label.__repr__())
 
@@ -181,6 +357,30 @@ class HarmonicLabel(AbstractLabel):
         elif ctype=='chroma':
             return self.chroma
 
+    def get_key(self):
+        # labels are compared on their SOM class
+        return int(self.label)
+
+    @classmethod
+    def get_label_from_key(cls, key, chroma=None):
+        # SOM class is already known : no classification
+        return cls(int(key), chroma)
+
+    @classmethod
+    def get_keys_from_data(cls, data):
+        if all(type(d)==dict for d in data):
+            return cls.classifier.classify_batch([d["chroma"] for d in data]).tolist()
+        return super(HarmonicLabel, cls).get_keys_from_data(data)
+
+    @classmethod
+    def get_values(cls, labels):
+        # values of harmonic labels are their chromas
+        return np.array([label.chroma for label in labels], dtype='float32').reshape(-1, 12)
+
+    @classmethod
+    def get_keys_from_values(cls, values, mod12=False):
+        return cls.classifier.classify_batch(values).tolist()
+
     def __eq__(self, a):
         if type(a)==type(None):
             return False
@@ -191,10 +391,7 @@ class HarmonicLabel(AbstractLabel):
         elif issubclass(type(a), MelodicLabel):
             return np.amax(self.chroma)==a.label # replace by virtual fundamental?
         elif type(a)==list or  type(a)==tuple:
-            clust_vec = np.exp(-self.node_specificity*np.sqrt(np.sum(np.power(a-HarmonicLabel.som,2), axis=1)))
-            indtmp = np.argsort(clust_vec)
-            id_c =  HarmonicLabel.som_c[indtmp[-1]]
-            return self.label==id_c
+            return self.label==self.classifier.classify(a)
         else:
             raise TypeError("Failed comparing Harmonic Label with ", a.__repr__())
 
@@ -215,9 +412,7 @@ class HarmonicLabel(AbstractLabel):
                 chroma[pitch%12] = 1.0
                 label = cls(chroma)
             elif type(data)==cls:
-                label = cls()
-                label.label = deepcopy(data.label)
-                label.chroma = deepcopy(data.chroma)
+                label = data
             else:
                 pitch = data.label
                 try:
@@ -262,17 +457,19 @@ class HarmonicLabel(AbstractLabel):
 #   it defines mandatory functions that the contents subclasses must handle
 
 
-class AbstractContents(object):
+class AbstractContents(ValueObject):
+    __slots__ = ('contents',)
+    type = "abstract"
     def __init__(self, contents={}):
         self.set_contents(contents)
-        self.type = "abstract"
 
     @classmethod
     def __desc__(self):
         return "Abstract contents"
 
     def set_contents(self, contents):
-        self.contents = contents;
+        '''sets the contents while the object is built'''
+        self._set('contents', contents)
 
     def get_contents(self):
         '''returns state length'''
@@ -296,13 +493,22 @@ class AbstractContents(object):
 
 
 
+# notes of MIDI contents are compiled once in a (7 x notes) array, whose rows
+#   are relative onset and duration, absolute onset and duration, pitch,
+#   velocity and channel. get_note_arrays reads them back in one operation,
+#   lengths being scaled by tempo as a whole row. transforms only modify the
+#   array : contents["notes"] keeps the notes as read, and note dictionaries
+#   of transformed contents are derived from the array by get_notes.
+
 class ClassicMIDIContents(AbstractContents):
+    __slots__ = ('notes',)
+    type = "midi"
+    RELATIVE, ABSOLUTE, PITCH, VELOCITY, CHANNEL = 0, 2, 4, 5, 6 # rows of notes
     def __init__(self, contents={}):
         AbstractContents.__init__(self, contents)
-        self.type = "midi"
 
     def __repr__(self):
-        return str(self.contents["notes"])
+        return str(self.get_notes())
 
     @classmethod
     def __desc__(self):
@@ -312,21 +518,38 @@ class ClassicMIDIContents(AbstractContents):
         if type(contents)==dict:
             if not "notes" in contents:
                 raise Exception("Failed to build MIDI Contents from ", contents)
-            self.contents = contents
+            self._set('contents', contents)
+            self._set_array('notes', self.compile_notes(contents["notes"]))
+
+    @staticmethod
+    def compile_notes(notes):
+        '''note array of a list of note dictionaries, notes of influences having no time'''
+        no_time = {"relative": [0.0, 0.0], "absolute": [0.0, 0.0]}
+        rows = []
+        for note in notes:
+            time = note.get("time", no_time)
+            rows.append(time["relative"] + time["absolute"] + [note["pitch"], note["velocity"], note.get("channel", 1)])
+        return np.array(rows, dtype=float).reshape(-1, 7).T.copy()
+
+    def get_notes(self):
+        '''note dictionaries, with the pitches of the note array'''
+        return [dict(note, pitch=pitch) for note, pitch in zip(self.contents["notes"], self.notes[self.PITCH].tolist())]
+
+    def get_note_arrays(self, timing="relative", factor=None):
+        '''returns a (4 x notes) array of onsets, lengths, pitches and velocities'''
+        row = self.RELATIVE if timing=="relative" else self.ABSOLUTE
+        notes = self.notes.take([row, row+1, self.PITCH, self.VELOCITY], axis=0)
+        if factor!=None:
+            if timing=="relative":
+                notes[1] *= self.contents["tempo"]
+            notes[1] /= factor
+        return notes
 
     def get_contents(self, timing="relative", factor=None):
-        content = []
-        for i in self.contents["notes"]:
-            if factor==None:
-                length =  i["time"][timing][1]
-            else:
-                if timing=="relative":
-                    length = i["time"][timing][1]*self.contents["tempo"]/factor
-                else:
-                    length = i["time"][timing][1]/factor
-            note = {'time': [i["time"][timing][0], length, self.contents["tempo"]], 'content':["midi", i["pitch"], i["velocity"], length]}
-            content.append(note)
-        return content
+        tempo = self.contents["tempo"]
+        onsets, lengths, pitches, velocities = self.get_note_arrays(timing, factor).tolist()
+        return [{'time': [onset, length, tempo], 'content':["midi", pitch, velocity, length]} \
+                    for onset, length, pitch, velocity in zip(onsets, lengths, pitches, velocities)]
 
     def get_state_length(self, timing = "relative", factor=None):
         length = None
@@ -355,7 +578,7 @@ class ClassicMIDIContents(AbstractContents):
             contents= cls.get_contents_from_data(data.get_contents())
         elif issubclass(type(data), AbstractContents):
             if issubclass(type(data), ClassicMIDIContents):
-                contents = deepcopy(data)
+                contents = data
         elif type(data)==dict:
             contents = cls(data)
         elif type(data)==str:
@@ -368,10 +591,11 @@ class ClassicMIDIContents(AbstractContents):
         return contents
 
 class ClassicAudioContents(AbstractContents):
-    def __init__(self, contents={}):
+    __slots__ = ('transpose',)
+    type = "audio"
+    def __init__(self, contents={}, transpose=0.0):
         AbstractContents.__init__(self, contents)
-        self.type = "audio"
-        self.transpose = 0.0 # transposition in cents
+        self._set('transpose', transpose) # transposition in cents
 
     def get_contents(self, timing="relative", factor=None):
         length = None
@@ -413,7 +637,7 @@ class ClassicAudioContents(AbstractContents):
             contents= cls.get_contents_from_data(data.get_contents())
         elif issubclass(type(data), AbstractContents):
             if issubclass(type(data), ClassicAudioContents):
-                contents = deepcopy(data)
+                contents = data
         elif type(data)==dict:
             content =  cls(data)
         elif type(data)==str:
@@ -428,10 +652,12 @@ class ClassicAudioContents(AbstractContents):
 ###############################################################################
 # AbstractEvent is a encapsulation of a label and and contents.
 
-class AbstractEvent(object):
-    def __init__(self, label, contents):
-        self.label = label # supposed to be an AbstractLabel subclass
-        self.contents = contents # supposed to be a AbstractContents subclass
+class AbstractEvent(ValueObject):
+    __slots__ = ('label', 'contents', 'index')
+    def __init__(self, label, contents, index=None):
+        self._set('label', label) # supposed to be an AbstractLabel subclass
+        self._set('contents', contents) # supposed to be a AbstractContents subclass
+        self._set('index', index) # position of the event in its memory
     def __repr__(self):
         return "<Abstract Event with "+self.label.__repr__()+' and '+self.contents.__repr__()+'>'
 
@@ -440,10 +666,10 @@ class AbstractEvent(object):
         return "Abstract Event"
 
     def get_label(self):
-        return deepcopy(self.label)
+        return self.label
 
     def get_contents(self):
-        return deepcopy(self.contents)
+        return self.contents
 
     def __eq__(self, a):
         if a==None:
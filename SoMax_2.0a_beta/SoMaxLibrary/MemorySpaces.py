@@ -1,16 +1,23 @@
 import numpy as np
-import json, bisect, os
+import json, bisect, os, threading, weakref
 import Events
 import Transforms
-from Tools import SequencedList, intersect
+import CorpusBuilder
+from Tools import SequencedList, LRUCache, intersect, object_array
 from collections import deque
-from copy import deepcopy
 
 # overloading Memory object, asserting a sequence of Event objects and embedding
 #    a given representation, with its influence function used by Atom objects
+#    states are stored as columns : dates, label keys the indexes are built on,
+#    and the raw data of each state (JSON state, row of a compiled corpus, or
+#    event appended live). events are only built when requested by get_event,
+#    and the last ones are kept in a bounded flyweight cache, as well as the
+#    last events decoded by transforms (see get_decoded_event).
 
 
 class AbstractMemorySpace(SequencedList):
+    event_cache_size = 256 # events kept built between two requests
+    decoded_cache_size = 1024 # decoded events kept, for (event, transforms) pairs
     def __init__(self, dates=[], states=[], \
                     label_type = Events.AbstractLabel, contents_type=Events.AbstractContents, event_type=Events.AbstractEvent):
         SequencedList.__init__(self, dates, states)
@@ -25,7 +32,15 @@ class AbstractMemorySpace(SequencedList):
             if type(event_type)==str:
                 self.event_type = getattr(Events, event_type)
         self.infos = dict()
-        self.available = True
+        self.current_file = None
+        self.typeID = None
+        self.shared = False # events and indexes are shared with other memory spaces
+        self.source = None # memory space the view was made from, kept alive for the pool
+        self.keys = [] # label key of each state
+        self.columns = None # compiled corpus the states are read from
+        self.index_offset = 0 # index of the first state in the memory it is a segment of
+        self.event_cache = LRUCache(self.event_cache_size)
+        self.decoded_cache = LRUCache(self.decoded_cache_size)
 
     def __repr__(self):
         return "AbstractActivityPattern"
@@ -34,41 +49,251 @@ class AbstractMemorySpace(SequencedList):
     def __desc__(self):
         return "Abstract Memory Space"
 
-    def read(self, file, *args):
-        return True # True if succeded, False if failed
+    def read(self, filez, timing='relative'):
+        if not os.path.isfile(filez):
+            print "Give a valid file!!"
+            return False
+        if os.path.splitext(filez)[1]=='.npz':
+            return self.read_compiled(filez, timing)
+        with open(filez, 'r') as jfile:
+            self.reset()
+            data = json.load(jfile)
+        if CorpusBuilder.is_legacy_corpus(data):
+            data = CorpusBuilder.convert_legacy_corpus(data)
+        self.set_type(data['typeID'])
+        self.reset()
+        # states are stored as the columns of a compiled corpus, without its indexes
+        corpus = CorpusBuilder.get_corpus_columns(data)
+        corpus['note_bounds'] = CorpusBuilder.get_note_bounds(corpus)
+        self.load_columns(corpus, timing, data['data'][1:])
+        self.index_states(0)
+        self.current_file = filez
+        return True
+
+    def read_compiled(self, filez, timing='relative'):
+        '''reads a corpus compiled by CorpusBuilder.compile_corpus'''
+        corpus = CorpusBuilder.load_compiled_corpus(filez)
+        self.set_type(corpus['typeID'])
+        self.reset()
+        self.load_compiled(corpus, timing)
+        self.current_file = filez
+        return True
+
+    def load_compiled(self, corpus, timing='relative'):
+        self.load_columns(corpus, timing)
+        self.index_states(0)
+
+    def load_columns(self, corpus, timing='relative', states=None):
+        '''appends the states of a compiled corpus, their events being built
+        from its columns when requested. label keys missing from the corpus
+        are computed from states, the raw data of the columns, if given.'''
+        column = self.label_type.compiled_key
+        if not column in corpus:
+            keys = self.get_keys_from_data(CorpusBuilder.get_compiled_states(corpus) if states is None else states)
+        else:
+            keys = corpus[column].tolist()
+        self.columns = corpus
+        self.keys.extend(keys)
+        column = 0 if timing=='relative' else 1
+        SequencedList.extend(self, corpus['onset'][:, column], [None]*len(keys))
+
+    def set_type(self, typeID):
+        self.typeID = typeID
+        if self.typeID=="MIDI":
+            self.contents_type = Events.ClassicMIDIContents
+        elif self.typeID=="Audio":
+            self.contents_type = Events.ClassicAudioContents
 
     def append(self, date, *args):
+        self.unshare()
         event = self.build_event(*args)
         SequencedList.append(self, date, event)
+        self.keys.append(event.label.get_key())
         # and then additional processing specific to the Memory Space
+        self.index_states(len(self)-1)
+
+    def extend(self, dates, data):
+        '''bulk append of several states from their raw data, their events
+        being built when requested'''
+        self.unshare()
+        start = len(self)
+        data = data[0:min(len(dates), len(data))]
+        SequencedList.extend(self, dates, data)
+        self.keys.extend(self.get_keys_from_data(data))
+        self.index_states(start)
+
+    def get_keys_from_data(self, data):
+        '''label keys of states appended from their raw data'''
+        return self.label_type.get_keys_from_data(data)
+
+    def __getitem__(self, b):
+        if type(b)==slice:
+            return self.__getslice__(b.start, b.stop)
+        b = self._index(b)
+        return float(self._dates[b]), self.get_event(b)
+
+    def __iter__(self):
+        return ((float(self._dates[i]), self.get_event(i)) for i in xrange(len(self)))
+
+    def __getslice__(self, b, c):
+        b, c, _ = slice(b, c).indices(len(self))
+        return SequencedList(self._dates[b:max(b, c)], [self.get_event(i) for i in xrange(b, c)])
+
+    # events are read through get_event, the event column holding state data
+    @property
+    def orderedEventList(self):
+        return object_array(self.get_events_list())
+
+    def get_events_list(self):
+        return [self.get_event(i) for i in xrange(len(self))]
+
+    def get_events(self, zeta_list):
+        if not len(self):
+            return [], []
+        indices, distances = self.get_nearest(zeta_list)
+        states = [None if j<0 else self.get_event(j) for j in indices.tolist()]
+        distances = [None if j<0 else d for j, d in zip(indices.tolist(), distances.tolist())]
+        return states, distances
+
+    def get_event(self, i):
+        '''event of state i, built from the state data if not cached'''
+        i = self._index(int(i))
+        event = self._events[i]
+        if not event is None and type(event)!=dict:
+            return event # appended as an event
+        event = self.event_cache.get(i)
+        if event is None:
+            event = self.build_state_event(i)
+            self.event_cache.put(i, event)
+        return event
+
+    def get_decoded_event(self, i, transforms):
+        '''event of state i decoded by transforms, given as registry IDs.
+        decoded events are cached, events being immutable.'''
+        i = self._index(int(i))
+        key = (i, tuple(transforms))
+        event = self.decoded_cache.get(key)
+        if event is None:
+            event = self.get_event(i)
+            for transform_id in transforms:
+                event = Transforms.get_transform(transform_id).decode(event)
+            self.decoded_cache.put(key, event)
+        return event
+
+    def get_metrics(self):
+        return {"event_cache":self.event_cache.get_metrics(), "decoded_cache":self.decoded_cache.get_metrics()}
+
+    def build_state_event(self, i):
+        state = self._events[i]
+        if state is None:
+            state = CorpusBuilder.get_compiled_state(self.columns, i)
+        if self.label_type.compiled_key is None or self.keys[i] is None:
+            label = self.label_type.get_label_from_data(state)
+        else:
+            label = self.label_type.get_label_from_key(self.keys[i], state['chroma'])
+        return self.event_type(label, self.contents_type.get_contents_from_data(state), self.index_offset+i)
+
+    def index_states(self, start):
+        '''indexes the states appended from start'''
+        pass
+
+    def get_options(self):
+        '''load options, distinguishing shared memory spaces of a same file
+        (contents type is given by the file)'''
+        return (self.label_type, self.event_type)
+
+    def get_settings(self):
+        '''influence settings, copied to the empty copies and views of the memory space'''
+        return dict()
+
+    def share(self, settings=None):
+        '''returns a view sharing events and indexes with this memory space,
+        with its own influence state, and settings if given (its own otherwise).
+        events and indexes are copied on their next append.'''
+        self.shared = True
+        view = self.__class__.__new__(self.__class__)
+        view.__dict__.update(self.__dict__)
+        view.__dict__.update(self.get_settings() if settings is None else settings)
+        view.source = self if self.source is None else self.source
+        view.reset_influence()
+        return view
+
+    def unshare(self):
+        '''copies shared events and indexes, before modifying them'''
+        if not self.shared:
+            return
+        self._dates = self._dates.copy()
+        self._events = self._events.copy()
+        self.keys = list(self.keys)
+        self.decoded_cache = LRUCache(self.decoded_cache_size) # states appended from now on are not shared
+        self.copy_indexes()
+        self.shared = False
+        self.source = None
+
+    def copy_indexes(self):
+        pass
+
+    def reset_influence(self):
+        pass
+
+    def clear(self):
+        SequencedList.clear(self)
+        self.shared = False
+        self.source = None
+        self.keys = []
+        self.columns = None
+        self.index_offset = 0
+        self.event_cache = LRUCache(self.event_cache_size)
+        self.decoded_cache = LRUCache(self.decoded_cache_size)
 
     def influence(self, event):
       #print "here, the memory influences its internal state and returns activity peaks"
         return [], [] # returns dates and activities
 
     def isAvailable(self):
-        return bool(self.available) # securities
+        return True # memory spaces are loaded aside and published by their atom
+
+    def empty_copy(self):
+        '''returns an empty memory space with the same settings'''
+        memory_space = self.__class__(label_type = self.label_type, contents_type = self.contents_type, event_type = self.event_type)
+        memory_space.__dict__.update(self.get_settings())
+        memory_space.reset_influence()
+        return memory_space
 
     # build event from external data
     def build_event(self, *args, **kwargs):
         label = self.label_type.get_label_from_data(*args, **kwargs)
         contents = self.contents_type.get_contents_from_data(*args, **kwargs)
-        event = self.event_type(label, contents)
-        event.index = len(self)
-        return event
+        return self.event_type(label, contents, len(self))
+
+    def get_encoded_keys(self, labels, transforms):
+        '''returns, for each transform, the tuple of keys of the encoded labels.
+        labels are encoded in one batch when their type registers batch functions.'''
+        label_type = type(labels[-1])
+        try:
+            values = label_type.get_values(labels)
+            encoded = [transform.encode_batch(values, label_type) for transform in transforms]
+        except Transforms.TransformError:
+            return [tuple(transform.encode(label).get_key() for label in labels) for transform in transforms]
+        keys = label_type.get_keys_from_values(np.concatenate(encoded), labels[-1].mod12)
+        n = len(labels)
+        return [tuple(keys[i*n:(i+1)*n]) for i in xrange(len(transforms))]
 
     def reset(self):
-        pass
+        self.clear()
 
 class NGramMemorySpace(AbstractMemorySpace):
     def __init__(self, dates=[], states=[], \
                     label_type = Events.AbstractLabel, contents_type=Events.AbstractContents, event_type=Events.AbstractEvent):
         AbstractMemorySpace.__init__(self, [], [], label_type, contents_type, event_type)
+        self.max_ngram = 6 # n-grams of every order up to max_ngram are indexed
         self.ngram_size = 3
+        self.order_weights = None # {order: weight} to blend several orders
         self.subsequences = dict()
-        self.buffer = deque([], self.ngram_size)
-        self.current_file = None
-        self.typeID = None
+        self.intervals = dict() # transposition-invariant index of transposable labels
+        self.subsequences12 = None # octave independent indexes, built at the first mod12 influence
+        self.intervals12 = None
+        self.buffer = deque([], self.max_ngram)
         self.transforms = [Transforms.NoTransform, Transforms.TransposeTransform]
         for i in range(0, min(len(dates), len(states))):
             self.append(dates[i], states[i])
@@ -76,43 +301,107 @@ class NGramMemorySpace(AbstractMemorySpace):
     def __repr__(self):
         return "N-Gram based memory"
 
+    def get_settings(self):
+        return {"max_ngram":self.max_ngram, "ngram_size":self.ngram_size, "transforms":list(self.transforms), \
+                "order_weights":None if self.order_weights is None else dict(self.order_weights)}
+
     def __desc__(self):
         return str(self.ngram_size)+"-NGram based memory space"
 
-    # 26/09 : redefinir append et definir insert
-    def append(self, date, *args):
-        AbstractMemorySpace.append(self, date, *args)
-        if len(self.orderedEventList)<self.ngram_size:
+    def index_states(self, start):
+        for i in xrange(start, len(self)):
+            self.index_state(i)
+
+    def get_options(self):
+        return AbstractMemorySpace.get_options(self) + (self.max_ngram,)
+
+    def copy_indexes(self):
+        self.subsequences = dict((seq, list(states)) for seq, states in self.subsequences.iteritems())
+        self.intervals = dict((seq, list(states)) for seq, states in self.intervals.iteritems())
+        if self.subsequences12!=None:
+            self.subsequences12 = dict((seq, list(states)) for seq, states in self.subsequences12.iteritems())
+        if self.intervals12!=None:
+            self.intervals12 = dict((seq, list(states)) for seq, states in self.intervals12.iteritems())
+
+    def reset_influence(self):
+        self.buffer = deque([], self.max_ngram)
+
+    def load_compiled(self, corpus, timing='relative'):
+        column = self.label_type.compiled_key
+        if column is None or corpus['max_ngram']<self.max_ngram:
+            AbstractMemorySpace.load_compiled(self, corpus, timing)
             return
-        # adding n-plets to subsequences dict
-        seq = self.orderedEventList[-(self.ngram_size):len(self.orderedEventList)]
-        seq = tuple(map(lambda state: state.get_label(), seq))
-        dic = dict(self.subsequences)
-        if len(dic)==0:
-            self.subsequences[seq] = [len(self.orderedEventList)-1]
-        else:
-            sub_keys = self.subsequences.keys()
-            if seq in sub_keys:
-                j = sub_keys.index(seq)
-                self.subsequences[sub_keys[j]].append(len(self.orderedEventList)-1)
-            else:
-                self.subsequences[seq] = [len(self.orderedEventList)-1]
+        # loading prebuilt indexes instead of indexing states
+        self.load_columns(corpus, timing)
+        for order in range(1, self.max_ngram+1):
+            self.subsequences.update(CorpusBuilder.unpack_index(corpus, 'index_'+column+'_'+str(order)))
+        if self.label_type.transposable:
+            for seq, states in self.subsequences.iteritems():
+                if len(seq)>1:
+                    self.intervals.setdefault(self.get_intervals(seq), []).extend(states)
+            for states in self.intervals.itervalues():
+                states.sort()
+
+    def index_state(self, i):
+        '''adds the n-grams of every order ending at state i to subsequences dict'''
+        keys = tuple(self.keys[max(i+1-self.max_ngram, 0):i+1])
+        for order in xrange(1, len(keys)+1):
+            seq = keys[-order:]
+            try:
+                self.subsequences[seq].append(i)
+            except KeyError:
+                self.subsequences[seq] = [i]
+            if self.subsequences12!=None:
+                self.subsequences12.setdefault(tuple(k%12 for k in seq), []).append(i)
+            if self.label_type.transposable and order>1:
+                # labels of the memory are built from data, octave dependent
+                intervals = self.get_intervals(seq)
+                try:
+                    self.intervals[intervals].append(i)
+                except KeyError:
+                    self.intervals[intervals] = [i]
+                if self.intervals12!=None:
+                    self.intervals12.setdefault(tuple(k%12 for k in intervals), []).append(i)
+
+    def get_intervals(self, keys, mod12=False):
+        '''intervals between successive keys, invariant by transposition'''
+        if mod12:
+            return tuple((b-a)%12 for a, b in zip(keys[:-1], keys[1:]))
+        return tuple(b-a for a, b in zip(keys[:-1], keys[1:]))
+
+    def get_subsequences(self, mod12=False):
+        '''n-gram index, keyed on octave independent keys if mod12'''
+        if not mod12:
+            return self.subsequences
+        if self.subsequences12 is None:
+            self.subsequences12 = self.reduce_index(self.subsequences)
+        return self.subsequences12
+
+    def get_interval_index(self, mod12=False):
+        '''interval index, keyed on intervals modulo 12 if mod12'''
+        if not mod12:
+            return self.intervals
+        if self.intervals12 is None:
+            self.intervals12 = self.reduce_index(self.intervals)
+        return self.intervals12
+
+    def reduce_index(self, index):
+        '''index merging the entries of index whose keys are equal modulo 12'''
+        reduced = dict()
+        for seq, states in index.iteritems():
+            reduced.setdefault(tuple(k%12 for k in seq), []).extend(states)
+        for states in reduced.itervalues():
+            states.sort()
+        return reduced
 
     def build_subsequences(self):
-        if len(self)<self.ngram_size:
-            return
         self.subsequences = dict()
-        bufr = deque([], self.ngram_size)
-        for z,v in self:
-            bufr.append(v.get_label())
-            if len(bufr)>=self.ngram_size:
-                seq = tuple(bufr)
-                try:
-                    self.subsequences[seq].append(z)
-                except:
-                    self.subsequences[seq] = [z]
-                    pass
-        self.buffer = deque([], self.ngram_size)
+        self.intervals = dict()
+        self.subsequences12 = None
+        self.intervals12 = None
+        for i in xrange(len(self)):
+            self.index_state(i)
+        self.buffer = deque(self.buffer, self.max_ngram)
 
 
     def influence(self, data, **kwargs):
@@ -123,53 +412,604 @@ class NGramMemorySpace(AbstractMemorySpace):
         valid_transforms = self.transforms # getting appropriate transformations
         for Transform in valid_transforms:
             transforms.extend(Transform.get_transformation_patterns())
-        if len(self.buffer)>=self.ngram_size:
-            for transform in transforms:
-                k = tuple(map(lambda x: transform.encode(x), self.buffer))
-                values = []
-                c = None
-                for t, z in self.subsequences.iteritems():
-                    if k==t:
-                        c=t
-                        break
-                if c!=None:
-                    for state in self.subsequences[c]:
-
-                        peaks.append(tuple([self.orderedDateList[int(state)], 1.0, deepcopy(transform)]))
+        semitones = self.get_semitones(transforms)
+        buffer = list(self.buffer)
+        orders = self.order_weights if self.order_weights!=None else {self.ngram_size: 1.0}
+        for order, weight in orders.iteritems():
+            if len(buffer)<order or weight==0:
+                continue
+            labels = buffer[-order:]
+            if semitones!=None and order>1 and labels[-1].transposable:
+                # one interval lookup gives the matches of every transposition
+                keys = tuple(label.get_key() for label in labels)
+                mod12 = labels[-1].mod12
+                intervals = self.get_interval_index(mod12)
+                for state in intervals.get(self.get_intervals(keys, mod12), []):
+                    offset = self.keys[state]-keys[-1]
+                    for semitone, transform_id in semitones:
+                        if semitone==offset or (mod12 and (semitone-offset)%12==0):
+                            peaks.append((self.orderedDateList[state], weight, transform_id))
+            else:
+                # subsequences are indexed by label keys : direct lookup
+                subsequences = self.get_subsequences(labels[-1].mod12)
+                for transform, k in zip(transforms, self.get_encoded_keys(labels, transforms)):
+                    transform_id = Transforms.get_transform_id(transform)
+                    for state in subsequences.get(k, []):
+                        peaks.append((self.orderedDateList[int(state)], weight, transform_id))
         return peaks
 
-    def read(self, filez, timing='relative'):
-        if not os.path.isfile(filez):
-            print "Give a valid file!!"
-            return False
-        with open(filez, 'r') as jfile:
-            self.reset()
-            data = json.load(jfile)
-        self.available = False
-        self.typeID = data['typeID']
-        if self.typeID=="MIDI":
-            self.contents_type = Events.ClassicMIDIContents
-        elif self.typeID=="Audio":
-            self.contents_type = Events.ClassicAudioContents
-        self.reset()
-        for i in range(1, len(data['data'])):
-            self.append(data['data'][i]['time'][timing][0], data['data'][i])
-        self.available = True
-        self.current_file = filez
-        return True
+    def get_semitones(self, transforms):
+        '''returns (semitone, transform ID) pairs if transforms are all
+        transpositions, None otherwise'''
+        semitones = []
+        for transform in transforms:
+            if not type(transform) in (Transforms.NoTransform, Transforms.TransposeTransform):
+                return None
+            semitones.append((getattr(transform, "semitone", 0), Transforms.get_transform_id(transform)))
+        return semitones
 
     def change_ngram(self, ngram_size):
         try:
-            self.ngram_size = int(ngram_size)
+            ngram_size = int(ngram_size)
         except:
             print("[ERROR memorySpace] ngram size must be an integer")
+            return
+        if ngram_size<1:
+            print("[ERROR memorySpace] ngram size must be positive")
+            return
         self.ngram_size = ngram_size
-        self.build_subsequences()
+        if ngram_size>self.max_ngram:
+            # orders above max_ngram are not indexed yet
+            self.max_ngram = ngram_size
+            self.unshare()
+            self.build_subsequences()
         print("[INFO] ngram size of", self, "set to", ngram_size)
 
+    def set_order_weights(self, weights):
+        '''blends several orders, weights being a dictionary {order: weight}
+        or a list of weights from order 1. None only uses ngram_size.'''
+        if weights!=None:
+            if type(weights)!=dict:
+                weights = dict((order+1, weight) for order, weight in enumerate(weights))
+            weights = dict((int(order), float(weight)) for order, weight in weights.iteritems())
+            if max(weights.keys())>self.max_ngram:
+                self.max_ngram = max(weights.keys())
+                self.unshare()
+                self.build_subsequences()
+        self.order_weights = weights
 
     def reset(self):
-        self.buffer = deque([], self.ngram_size)
+        self.buffer = deque([], self.max_ngram)
         self.subsequences = dict()
-        self.orderedDateList = list()
-        self.orderedEventList = list()
+        self.intervals = dict()
+        self.subsequences12 = None
+        self.intervals12 = None
+        self.clear()
+
+
+
+###############################################################################
+# SuffixAutomatonMemorySpace indexes the memory with a suffix automaton, built
+#   online in linear time over label keys. instead of a fixed-length context,
+#   each influence extends the longest suffix of the influence stream that is
+#   matched in the memory, and returns every position where that suffix ends.
+#   automaton states are end-position classes : positions of a state are the
+#   ones of its subtree in the suffix links tree. octave independent (mod12)
+#   influences are matched on a second automaton over keys modulo 12, built at
+#   the first of them.
+
+class SuffixAutomaton(object):
+    def __init__(self):
+        self.length, self.link, self.position, self.trans, self.children = [], [], [], [], []
+        self.last = self.new_state(0, -1, -1)
+
+    def copy(self):
+        automaton = SuffixAutomaton.__new__(SuffixAutomaton)
+        automaton.length, automaton.link, automaton.position = list(self.length), list(self.link), list(self.position)
+        automaton.trans = [dict(t) for t in self.trans]
+        automaton.children = [set(c) for c in self.children]
+        automaton.last = self.last
+        return automaton
+
+    def new_state(self, length, link, position, trans=None):
+        self.length.append(length)
+        self.link.append(link)
+        self.position.append(position)
+        self.trans.append(dict() if trans is None else dict(trans))
+        self.children.append(set())
+        if link>-1:
+            self.children[link].add(len(self.length)-1)
+        return len(self.length)-1
+
+    def set_link(self, state, link):
+        self.children[self.link[state]].discard(state)
+        self.link[state] = link
+        self.children[link].add(state)
+
+    def add_state(self, key, matches=None):
+        '''online construction step of the automaton for the next key.
+        matches, a {transform ID: (state, length)} dict, are kept valid.'''
+        cur = self.new_state(self.length[self.last]+1, 0, self.length[self.last])
+        p = self.last
+        while p>-1 and not key in self.trans[p]:
+            self.trans[p][key] = cur
+            p = self.link[p]
+        if p>-1:
+            q = self.trans[p][key]
+            if self.length[p]+1==self.length[q]:
+                self.set_link(cur, q)
+            else:
+                # splitting q : clones carry no position of their own
+                clone = self.new_state(self.length[p]+1, self.link[q], -1, self.trans[q])
+                while p>-1 and self.trans[p].get(key)==q:
+                    self.trans[p][key] = clone
+                    p = self.link[p]
+                self.set_link(q, clone)
+                self.set_link(cur, clone)
+                # current matches shorter than the clone now belong to it
+                for transform_id, (state, length) in (matches or {}).iteritems():
+                    if state==q and length<=self.length[clone]:
+                        matches[transform_id] = (clone, length)
+        self.last = cur
+
+    def follow(self, state, length, key):
+        '''extends the match (state, length) with key, falling back on
+        suffix links when the automaton has no such transition'''
+        while True:
+            if key in self.trans[state]:
+                return self.trans[state][key], length+1
+            if state==0:
+                return 0, 0
+            state = self.link[state]
+            length = self.length[state]
+
+    def get_positions(self, state):
+        '''indices of the events ending the strings of state'''
+        positions = []
+        stack = [state]
+        while stack:
+            s = stack.pop()
+            if self.position[s]>-1:
+                positions.append(self.position[s])
+            stack.extend(self.children[s])
+        return positions
+
+class SuffixAutomatonMemorySpace(AbstractMemorySpace):
+    def __init__(self, dates=[], states=[], \
+                    label_type = Events.AbstractLabel, contents_type=Events.AbstractContents, event_type=Events.AbstractEvent):
+        AbstractMemorySpace.__init__(self, [], [], label_type, contents_type, event_type)
+        self.min_length = 3 # minimum length of a matched suffix to create peaks
+        self.transforms = [Transforms.NoTransform, Transforms.TransposeTransform]
+        self.reset()
+        for i in range(0, min(len(dates), len(states))):
+            self.append(dates[i], states[i])
+
+    def __repr__(self):
+        return "Suffix automaton based memory"
+
+    def __desc__(self):
+        return "Suffix automaton based memory space"
+
+    def get_settings(self):
+        return {"min_length":self.min_length, "transforms":list(self.transforms)}
+
+    def index_states(self, start):
+        for i in xrange(start, len(self)):
+            self.automaton.add_state(self.keys[i], self.matches.get(False))
+            if self.automaton12!=None:
+                self.automaton12.add_state(self.keys[i]%12, self.matches.get(True))
+
+    def copy_indexes(self):
+        self.automaton = self.automaton.copy()
+        if self.automaton12!=None:
+            self.automaton12 = self.automaton12.copy()
+
+    def reset_influence(self):
+        self.matches = dict()
+
+    def get_automaton(self, mod12=False):
+        '''automaton of the memory, over octave independent keys if mod12'''
+        if not mod12:
+            return self.automaton
+        if self.automaton12 is None:
+            self.automaton12 = SuffixAutomaton()
+            for key in self.keys:
+                self.automaton12.add_state(key%12)
+        return self.automaton12
+
+    def influence(self, data, **kwargs):
+        event = self.build_event(*data, **kwargs)
+        label = event.label
+        automaton = self.get_automaton(label.mod12)
+        matches = self.matches.setdefault(label.mod12, dict()) # current (state, length) for each transform ID
+        transforms = []
+        peaks = []
+        for Transform in self.transforms:
+            transforms.extend(Transform.get_transformation_patterns())
+        for transform, (key,) in zip(transforms, self.get_encoded_keys([label], transforms)):
+            transform_id = Transforms.get_transform_id(transform)
+            state, length = matches.get(transform_id, (0, 0))
+            state, length = automaton.follow(state, length, key)
+            matches[transform_id] = (state, length)
+            if length>=self.min_length:
+                for position in automaton.get_positions(state):
+                    peaks.append((self.orderedDateList[position], 1.0, transform_id))
+        return peaks
+
+    def set_min_length(self, min_length):
+        try:
+            self.min_length = int(min_length)
+        except:
+            print("[ERROR memorySpace] minimum length must be an integer")
+
+    def reset(self):
+        self.automaton = SuffixAutomaton()
+        self.automaton12 = None # octave independent automaton, built at the first mod12 influence
+        self.matches = dict() # current matches of influences, octave dependent or not
+        self.clear()
+
+
+
+###############################################################################
+# ChromaMemorySpace matches chromas by similarity instead of SOM classes, so
+#   that near-miss harmonies still create activity. chromas of the memory are
+#   stored as a (states x 12) float32 matrix, and an influence is answered by a
+#   single matrix product with the influence chroma rolled by each
+#   transposition. each state keeps its best transposition, and the top_k
+#   states whose similarity is above min_similarity are peaks. similarity is
+#   either the cosine, or 1/(1+d) for the euclidean distance d : transpositions
+#   keep the norm of the chroma, so both are given by the same product.
+#   chromas being octave independent, mod12 influences need no specific
+#   index : pitch influences are matched by their pitch class anyway. states
+#   are not classified by the SOM when read, their labels being only built
+#   with their events.
+
+class ChromaMemorySpace(AbstractMemorySpace):
+    metrics = ['cosine', 'euclidean']
+    def __init__(self, dates=[], states=[], \
+                    label_type = Events.HarmonicLabel, contents_type=Events.AbstractContents, event_type=Events.AbstractEvent):
+        AbstractMemorySpace.__init__(self, [], [], label_type, contents_type, event_type)
+        self.metric = 'cosine'
+        self.top_k = 8 # maximum number of peaks of an influence
+        self.min_similarity = 0.5
+        self.transforms = [Transforms.NoTransform, Transforms.TransposeTransform]
+        self.reset()
+        for i in range(0, min(len(dates), len(states))):
+            self.append(dates[i], states[i])
+
+    def __repr__(self):
+        return "Chroma similarity based memory"
+
+    def __desc__(self):
+        return "Chroma similarity based memory space ("+self.metric+")"
+
+    def get_settings(self):
+        return {"metric":self.metric, "top_k":self.top_k, "min_similarity":self.min_similarity, "transforms":list(self.transforms)}
+
+    def get_chroma(self, data):
+        '''chroma of raw state data, event, label or influence, without SOM classification'''
+        if isinstance(data, (tuple, list)) and len(data)==1:
+            data = data[0]
+        if type(data)==str:
+            data = data.split(" ")
+        if hasattr(data, 'contents'):
+            data = data.label # event
+        if hasattr(data, 'chroma'):
+            return np.asarray(data.chroma, dtype='float32')
+        if hasattr(data, 'get_key'):
+            data = ['pitch', data.label] # labels without chroma
+        if type(data)==dict:
+            return np.asarray(data['chroma'], dtype='float32')
+        if isinstance(data, (tuple, list)) and str(data[0]) in ('midi', 'pitch'):
+            chroma = np.zeros(12, dtype='float32')
+            chroma[int(float(data[1]))%12] = 1.0
+            return chroma
+        if isinstance(data, (tuple, list)) and str(data[0])=='chroma':
+            data = data[1:]
+        chroma = np.asarray(data, dtype='float32')
+        if chroma.shape!=(12,):
+            raise Exception("chroma events must contain 12 values!")
+        return chroma
+
+    def get_keys_from_data(self, data):
+        return [None]*len(data) # keys are not used to match chromas
+
+    def index_states(self, start):
+        chromas = []
+        for i in xrange(start, len(self)):
+            state = self._events[i]
+            chromas.append(self.columns['chroma'][i] if state is None else self.get_chroma(state))
+        self.add_chromas(np.array(chromas, dtype='float32').reshape(-1, 12))
+
+    def load_compiled(self, corpus, timing='relative'):
+        self.load_columns(corpus, timing)
+        self.add_chromas(corpus['chroma'])
+
+    def add_chromas(self, chromas):
+        '''appends rows to the chroma matrix, grown by doubling'''
+        n, m = self.n_chromas, len(chromas)
+        if n+m>len(self.chromas):
+            capacity = max(n+m, 2*len(self.chromas), self.min_capacity)
+            matrix, norms = np.zeros((capacity, 12), dtype='float32'), np.zeros(capacity, dtype='float32')
+            matrix[0:n], norms[0:n] = self.chromas[0:n], self.norms[0:n]
+            self.chromas, self.norms = matrix, norms
+        self.chromas[n:n+m] = chromas
+        self.norms[n:n+m] = np.sqrt(np.sum(self.chromas[n:n+m]**2, axis=1))
+        self.n_chromas = n+m
+
+    def copy_indexes(self):
+        self.chromas, self.norms = self.chromas.copy(), self.norms.copy()
+
+    def get_queries(self, chroma, transforms):
+        '''(12 x transforms) matrix of the influence chroma encoded by each transform'''
+        queries = np.empty((12, len(transforms)), dtype='float32')
+        for j, transform in enumerate(transforms):
+            try:
+                queries[:, j] = transform.encode_batch(chroma, Events.HarmonicLabel)
+            except Transforms.TransformError:
+                label = transform.encode(Events.HarmonicLabel.get_label_from_key(0, chroma))
+                queries[:, j] = label.chroma
+        return queries
+
+    def influence(self, data, **kwargs):
+        n = self.n_chromas
+        if n==0:
+            return []
+        chroma = self.get_chroma(data)
+        transforms = dict()
+        for Transform in self.transforms:
+            for transform in Transform.get_transformation_patterns():
+                transforms.setdefault(Transforms.get_transform_id(transform), transform)
+        transform_ids = transforms.keys()
+        queries = self.get_queries(chroma, [transforms[t] for t in transform_ids])
+        products = np.dot(queries.T, self.chromas[0:n].T) # (transforms x states)
+        best = products.max(0)
+        norm = np.sqrt(np.dot(chroma, chroma))
+        if self.metric=='euclidean':
+            distances = self.norms[0:n]**2 - 2*best + norm**2
+            similarities = 1.0/(1.0+np.sqrt(np.maximum(distances, 0.0)))
+        else:
+            similarities = best/np.maximum(self.norms[0:n]*norm, 1e-9)
+        k = min(self.top_k, n)
+        states = np.argpartition(similarities, -k)[-k:]
+        states = states[similarities[states]>=self.min_similarity]
+        columns = products[:, states].argmax(0)
+        dates = self.orderedDateList[states].tolist()
+        return [(date, float(similarities[state]), transform_ids[j]) for date, state, j in zip(dates, states.tolist(), columns.tolist())]
+
+    def set_metric(self, metric):
+        if not metric in self.metrics:
+            print("[ERROR memorySpace] metric must be one of "+", ".join(self.metrics))
+            return
+        self.metric = metric
+
+    def set_top_k(self, top_k):
+        try:
+            self.top_k = max(int(top_k), 1)
+        except:
+            print("[ERROR memorySpace] top k must be an integer")
+
+    def set_min_similarity(self, min_similarity):
+        try:
+            self.min_similarity = float(min_similarity)
+        except:
+            print("[ERROR memorySpace] minimum similarity must be a number")
+
+    def reset(self):
+        self.chromas = np.zeros((0, 12), dtype='float32')
+        self.norms = np.zeros(0, dtype='float32')
+        self.n_chromas = 0
+        self.clear()
+
+
+
+###############################################################################
+# SegmentedMemorySpace maps a directory of corpora into one memory, each file
+#   being a segment placed after the previous one. segments are memory spaces
+#   of segment_type, read in order by a background thread, either all at once
+#   or, if loading is 'lazy', one at a time when the memory is influenced :
+#   influences never wait for a segment, and only reach the ones loaded so
+#   far. the first segment is read by read() itself, so that the memory is
+#   usable at once. loaded segments are published to every view of the
+#   memory space.
+
+class SegmentedMemorySpace(AbstractMemorySpace):
+    corpus_exts = ['.npz', '.json']
+    def __init__(self, dates=[], states=[], \
+                    label_type = Events.AbstractLabel, contents_type=Events.AbstractContents, event_type=Events.AbstractEvent):
+        AbstractMemorySpace.__init__(self, [], [], label_type, contents_type, event_type)
+        self.segment_type = NGramMemorySpace
+        self.loading = 'background' # 'background' or 'lazy'
+        self.segment_gap = 4.0 # dates between two segments
+        self.reset()
+
+    def __repr__(self):
+        return "Segmented memory"
+
+    def __desc__(self):
+        return "Segmented memory space of "+str(len(self.segments))+"/"+str(len(self.files))+" "+self.segment_type.__name__
+
+    def get_settings(self):
+        return {"segment_type":self.segment_type, "loading":self.loading, "segment_gap":self.segment_gap}
+
+    def get_options(self):
+        return AbstractMemorySpace.get_options(self) + (self.segment_type, self.loading, self.segment_gap)
+
+    def get_files(self, path):
+        '''corpora of a directory, compiled ones being preferred to their source'''
+        if not os.path.isdir(path):
+            return [path]
+        files = dict()
+        for f in sorted(os.listdir(path)):
+            name, ext = os.path.splitext(f)
+            if ext in self.corpus_exts and (not name in files or ext=='.npz'):
+                files[name] = os.path.join(path, f)
+        return [files[name] for name in sorted(files.keys())]
+
+    def read(self, filez, timing='relative'):
+        if not os.path.exists(filez):
+            print "Give a valid file!!"
+            return False
+        self.reset()
+        self.timing = timing
+        self.files = self.get_files(filez)
+        if not self.load_next():
+            return False
+        self.current_file = filez
+        if self.loading=='background' and len(self.files)>1:
+            self.loader = threading.Thread(target=self.load_all, name="segments of "+filez)
+            self.loader.daemon = True
+            self.loader.start()
+        return True
+
+    def load_all(self):
+        while self.load_next():
+            pass
+
+    def request_next(self):
+        '''starts reading the next segment in background, unless a segment is being read'''
+        with self.library.lock:
+            if len(self.library.segments)>=len(self.files) or (self.loader!=None and self.loader.is_alive()):
+                return
+            self.loader = threading.Thread(target=self.load_next, name="segments of "+self.current_file)
+            self.loader.daemon = True
+            self.loader.start()
+
+    def load_next(self):
+        '''reads the next segment and publishes it, returns False if no segment is left'''
+        library = self.library
+        with library.loading:
+            i = len(library.segments)
+            if i>=len(self.files):
+                return False
+            segment = self.segment_type(label_type = self.label_type, contents_type = self.contents_type, event_type = self.event_type)
+            if segment.read(self.files[i], self.timing)==False:
+                print "[ERROR] failed to load segment", self.files[i]
+                self.files = self.files[0:i]
+                return False
+            with library.lock:
+                # placing the segment after the previous one
+                offset = len(self)
+                date_offset = 0.0
+                if offset and len(segment):
+                    date_offset = self.orderedDateList[-1] + self.segment_gap - segment.orderedDateList[0]
+                segment._dates[0:len(segment)] += date_offset
+                segment.index_offset = offset
+                segment.event_cache.clear()
+                library.segments.append((offset, segment))
+                library.views = [view for view in library.views if not view() is None]
+                for memory_space in [library.source()]+[view() for view in library.views]:
+                    if not memory_space is None:
+                        memory_space.add_segment(offset, segment)
+        print "[INFO] segment", self.files[i], "loaded at state", offset
+        return True
+
+    def add_segment(self, offset, segment):
+        if not self.library.source() is self:
+            segment = segment.share() # views influence their own view of the segment
+        self.unshare()
+        # the segment and its keys are published before the states, so that
+        #   concurrent readers find the segment of every state they see
+        self.segments.append((offset, segment))
+        self.keys.extend(segment.keys)
+        # events are built by their segment
+        SequencedList.extend(self, segment.orderedDateList, [None]*len(segment))
+
+    def get_event(self, i):
+        i = self._index(int(i))
+        if not self._events[i] is None:
+            return self._events[i] # appended as an event
+        offsets = [offset for offset, segment in self.segments]
+        offset, segment = self.segments[bisect.bisect_right(offsets, i)-1]
+        return segment.get_event(i-offset)
+
+    def influence(self, data, **kwargs):
+        if self.loading=='lazy' and len(self.library.segments)<len(self.files):
+            self.library.source().request_next()
+        peaks = []
+        for offset, segment in self.segments:
+            peaks.extend(segment.influence(data, **kwargs))
+        return peaks
+
+    def unshare(self):
+        # views keep their source alive, as they still share its segments
+        source = self.source
+        AbstractMemorySpace.unshare(self)
+        self.source = source
+
+    def share(self, settings=None):
+        with self.library.lock:
+            view = AbstractMemorySpace.share(self, settings)
+            view.segments = [(offset, segment.share()) for offset, segment in self.segments]
+            self.library.views.append(weakref.ref(view))
+            return view
+
+    def reset(self):
+        self.files = []
+        self.timing = 'relative'
+        self.segments = [] # (state offset, memory space) of segments published to this memory space
+        self.library = SegmentLibrary(self)
+        self.loader = None
+        self.clear()
+
+
+class SegmentLibrary(object):
+    '''segments loaded for a memory space, and the views they are published to'''
+    def __init__(self, source):
+        self.segments = []
+        self.source = weakref.ref(source)
+        self.views = [] # weak references, memory spaces being unhashable lists
+        self.loading = threading.Lock() # segments are read one at a time
+        self.lock = threading.RLock() # segments are published under lock
+
+
+###############################################################################
+# MemoryPool shares memory spaces read from a same file with the same options.
+#   atoms get views of the loaded memory space (see AbstractMemorySpace.share),
+#   that only hold a reference on it : the pool keeps weak references, so a
+#   memory space is freed as soon as no atom uses it anymore.
+
+class MemoryPool(object):
+    def __init__(self):
+        self.spaces = weakref.WeakValueDictionary()
+        self.loading = dict() # key: [lock, number of readers] of the files being read
+        self.lock = threading.Lock()
+
+    def get_key(self, memory_space, filez, timing):
+        filez = os.path.abspath(filez)
+        return (type(memory_space), filez, os.path.getmtime(filez), timing) + memory_space.get_options()
+
+    def read(self, memory_space, filez, timing='relative'):
+        '''returns a view of filez read with memory_space settings, reading it
+        in memory_space if not already loaded ; None if reading failed.
+        a file is read once at a time, other files being read meanwhile.'''
+        if not os.path.exists(filez):
+            print "Give a valid file!!"
+            return None
+        key = self.get_key(memory_space, filez, timing)
+        with self.lock:
+            loading = self.loading.setdefault(key, [threading.Lock(), 0])
+            loading[1] += 1
+        try:
+            with loading[0]:
+                with self.lock:
+                    source = self.spaces.get(key)
+                if source is None:
+                    if memory_space.read(filez, timing)==False:
+                        return None
+                    source = memory_space
+                    with self.lock:
+                        self.spaces[key] = source
+                else:
+                    print "[INFO] sharing memory of", filez
+                return source.share(memory_space.get_settings())
+        finally:
+            with self.lock:
+                loading[1] -= 1
+                if loading[1]==0:
+                    del self.loading[key]
+
+    def __len__(self):
+        return len(self.spaces)
+
+pool = MemoryPool()
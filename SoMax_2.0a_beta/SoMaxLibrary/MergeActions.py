@@ -50,28 +50,28 @@ class StateMergeAction(AbstractMergeAction):
         merged_pattern = SequencedList()
         states_list = []
         current_index = -1
+        indices, _ = self.memory_space.get_nearest(pattern.orderedDateList)
         for i in range(len(pattern)):
             #print 'looop ',i
             #print 'current_index : ', current_index
             z, (v, t) = pattern[i]
             #print 'pattern at ', i, ' : ', z, v, t
-            state, distance = self.memory_space.get_events(z)
-            state, distance = state[0], distance[0]
-            #print 'current state and distance : ', state, distance
+            state = indices[i]
+            #print 'current state : ', state
+            if state<0:
+                #print 'no state....'
+                continue
+
             if current_index==-1:
                 #print 'init loop'
                 za, (va, ta) = pattern[i]
-                merged_pattern.append(float(za), (float(va),deepcopy(ta)))
-                states_list.append(state.index)
+                merged_pattern.append(float(za), (float(va),ta))
+                states_list.append(state)
                 current_index += 1
                 #print 'merged pattern : ', merged_pattern
                 continue
 
-            if state==None:
-                #print 'no state....'
-                continue
-
-            if state.index==states_list[current_index]:
+            if state==states_list[current_index]:
                 #print 'conflicting states found'
                 if t == merged_pattern[current_index][1][1]:
                     #print "same transformations found"
@@ -92,7 +92,7 @@ class StateMergeAction(AbstractMergeAction):
                     if type(ta)!=list:
                         ta = [ta]
                     #print 'after conversion', ta
-                    cop = deepcopy(pattern[i][1][1])
+                    cop = pattern[i][1][1]
                     #print 'original pattern : ', pattern[i][1][1]
                     #print 'copy of original pattern : ', pattern[i][1][1]
                     ta = ta + [cop]
@@ -103,9 +103,9 @@ class StateMergeAction(AbstractMergeAction):
             else:
                 #print 'different states'
                 za, (va, ta) = pattern[i]
-                merged_pattern.append(float(za), (float(va),deepcopy(ta)))
-                states_list.append(state.index)
-                #print 'appending ', state.index, ' to state list'
+                merged_pattern.append(float(za), (float(va),ta))
+                states_list.append(state)
+                #print 'appending ', state, ' to state list'
                 current_index += 1
                 #print 'current merged pattern at ',current_index, ' : ', merged_pattern[current_index]
         return merged_pattern
@@ -56,10 +56,9 @@ class Player(object):
         # if event is specified, play it now
         if event_index!=None:
             self.reset()
-            event_index = int(event_index)
-            z_, event = self.current_streamview.atoms["_self"].memorySpace[event_index]
+            index = int(event_index)
             # using actual transformation?
-            transforms = [Transforms.NoTransform()]
+            transforms = [Transforms.NO_TRANSFORM]
             self.waiting_to_jump = False
         else:
             # get global activity
@@ -67,25 +66,27 @@ class Player(object):
 
             # if going to jump, erases peak in neighbour event
             if self.waiting_to_jump:
-                zetas = global_activity.get_dates_list()
-                states, _ = self.current_streamview.atoms["_self"].memorySpace.get_events(zetas)
-                for i in range(0, len(states)):
-                    if states[i].index == self.improvisation_memory[-1][0].index+1:
-                        del global_activity[i]
+                indices, _ = self.current_streamview.atoms["_self"].memorySpace.get_nearest(global_activity.orderedDateList)
+                global_activity.delete(np.flatnonzero(indices == self.improvisation_memory[-1][0].index+1))
                 self.waiting_to_jump = False
 
             if len(global_activity)!=0 and len(self.improvisation_memory)>0:
-                event, transforms = self.decide(global_activity)
-                if event==None:
+                index, transforms = self.decide(global_activity)
+                if index is None:
                     # if no event returned, choose default
-                    event, transforms = self.decide_default()
+                    index, transforms = self.decide_default()
                 if type(transforms)!=list:
                     transforms = [transforms]
             else:
                 # if activity is empty, choose default
-                event, transforms = self.decide_default()
-            for transform in transforms:
-                event = transform.decode(event)
+                index, transforms = self.decide_default()
+        # decisions are made on memory indices, only the chosen event is built
+        memory = self.current_streamview.atoms["_self"].memorySpace
+        if event_index==None:
+            # transforms are carried as registry IDs until the event is decoded
+            event = memory.get_decoded_event(index, transforms)
+        else:
+            event = memory.get_event(index)
         # add event to improvisation memory
         self.improvisation_memory.append((event, transforms))
         # influences private streamview if auto-influence activated
@@ -238,16 +239,17 @@ class Player(object):
 
     def get_merged_activity(self, date, weighted=True, filters=None, merge_actions=[StreamViews.DistanceMergeAction()]):
         '''getting activites of all streamviews of the player, merging with corresponding merge actions and optionally weighting'''
-        global_activity = Tools.SequencedList()
+        activities = []
+        weights = []
         weight_sum = self.get_weights_sum()
         if filters==None:
             filters = self.streamviews.keys()
         for f in filters:
-            activity = self.streamviews[f].get_merged_activity(date, weighted=weighted)
-            w = self.streamviews[f].weight/weight_sum if weighted else 1.0
-            global_activity = global_activity + activity.mul(w, 0)
-        si_w = self.current_streamview.weight/weight_sum if weighted else 1.0
-        global_activity = global_activity + self.current_streamview.get_merged_activity(date, weighted=True).mul(si_w, 0)
+            activities.append(self.streamviews[f].get_merged_activity(date, weighted=weighted))
+            weights.append(self.streamviews[f].weight/weight_sum if weighted else 1.0)
+        activities.append(self.current_streamview.get_merged_activity(date, weighted=True))
+        weights.append(self.current_streamview.weight/weight_sum if weighted else 1.0)
+        global_activity = Tools.SequencedList.merge_many(activities, weights, 0)
         for m in merge_actions:
             global_activity = m.merge(global_activity)
         return global_activity
@@ -390,30 +392,25 @@ class Player(object):
         '''default decision method : selecting conjoint event'''
         if len(self.improvisation_memory)!=0:
             previousState = self.improvisation_memory[-1][0]
-            new = self.current_streamview.atoms["_self"].memorySpace[(previousState.index+1)%len(self.current_streamview.atoms["_self"].memorySpace)]
+            new = (previousState.index+1)%len(self.current_streamview.atoms["_self"].memorySpace)
             trans = self.improvisation_memory[-1][1]
         else:
-            new = self.current_streamview.atoms["_self"].memorySpace[0]
-            trans = [Transforms.NoTransform()]
-        return new[1], trans
+            new = 0
+            trans = [Transforms.NO_TRANSFORM]
+        return new, trans
 
     def decide_chooseMax(self, global_activity):
-        '''choosing the state with maximum activity'''
-        zetas = global_activity.get_dates_list()
-        states, _ = self.current_streamview.atoms["_self"].memorySpace.get_events(zetas)
+        '''choosing the state with maximum activity, returns its memory index'''
+        memory = self.current_streamview.atoms["_self"].memorySpace
+        indices, _ = memory.get_nearest(global_activity.orderedDateList)
         v_t = global_activity.get_events_list()
-        v = map(lambda x: x[0], v_t)
-        for i in range(1, len(states)):
-            if not states[i] is None:
-                if states[i].index == self.improvisation_memory[-1][0].index+1:
-                    v[i]*=self.nextstate_mod
-        sorted_values = sorted( list(zip(v, range(len(v)))), key = operator.itemgetter(0), reverse = True)
-        max_value = sorted_values[0][0]
-        maxes = [n for n in itertools.takewhile(lambda x: x[0] == max_value, sorted_values)]
+        v = np.array(map(lambda x: x[0], v_t), dtype=float)
+        v[indices == self.improvisation_memory[-1][0].index+1] *= self.nextstate_mod
+        maxes = np.flatnonzero(v == v.max())
         next_state_index = random.choice(maxes)
-        next_state_index = next_state_index[1]
-        next_state, distance = self.current_streamview.atoms["_self"].memorySpace.get_events(zetas[next_state_index])
-        return next_state[0], v_t[next_state_index][1]
+        if indices[next_state_index] < 0:
+            return None, v_t[next_state_index][1]
+        return int(indices[next_state_index]), v_t[next_state_index][1]
 
     ######################################################
     ###### OSC METHODS
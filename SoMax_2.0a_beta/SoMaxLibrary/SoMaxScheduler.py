@@ -61,7 +61,6 @@ class SomaxScheduler(object):
         factor = self.tempo if self.timing_type=="relative" else self.timescale
 
         content_object = event.get_contents()
-        contents = content_object.get_contents(self.timing_type, factor)
         trig_mode = self.triggers[player]
         midiCheck = False
 
@@ -79,6 +78,20 @@ class SomaxScheduler(object):
             for elt in elts:
                 self.write(player, time+content_object.get_state_length(self.timing_type, factor), elt['content'])
 
+        if hasattr(content_object, "get_note_arrays"):
+            # midi notes are read from the note arrays of the contents
+            onsets, lengths, pitches, velocities = content_object.get_note_arrays(self.timing_type, factor).tolist()
+            tempo = content_object.get_tempo()
+            if onsets and not player in self.midi_queues:
+                self.midi_queues[player] = MIDIQueue()
+            for onset, length, pitch, velocity in zip(onsets, lengths, pitches, velocities):
+                note = self.midi_queues[player].process_midi_note(onset, pitch, velocity, length, tempo, trig_mode)
+                if note!=None:
+                    tempos.append(float(tempo))
+                    self.write(player, time + note[0], note[1])
+            contents = []
+        else:
+            contents = content_object.get_contents(self.timing_type, factor)
         for elt in contents:
             if elt['content'][0]=='midi':
                 if not player in self.midi_queues:
@@ -165,26 +178,34 @@ class MIDIQueue(object):
     def process_midi_event(self, event, triggering_mode="automatic"):
         midi, pitch, velocity, duration = event['content']
         offset, duration ,tempo = event['time']
-        event_to_output = None
+        note = self.process_midi_note(offset, pitch, velocity, duration, tempo, triggering_mode)
+        if note is None:
+            return None
+        offset, content = note
+        return {"time":[offset, content[3] if content[2]>0 else 0, tempo], "content":content}
+
+    def process_midi_note(self, offset, pitch, velocity, duration, tempo, triggering_mode="automatic"):
+        '''returns the (offset, content) of the note to output, or None'''
+        note_to_output = None
         if velocity>0 and duration>0:
             if triggering_mode == "reactive":
                 duration = 1000
             self.held_notes.append(pitch)
-            event_to_output = {"time":[offset, duration, tempo], "content":[midi, pitch, velocity, duration]}
+            note_to_output = offset, ["midi", pitch, velocity, duration]
         elif velocity==0:
             # normally, accumulate note offs
             if pitch in self.held_notes:
                 i = self.held_notes.index(pitch)
                 del self.held_notes[i]
-                event_to_output = {"time":[offset, 0, tempo], "content":[midi, pitch, 0 ,duration]}
+                note_to_output = offset, ["midi", pitch, 0 ,duration]
         elif offset<0:
             if not pitch in self.held_notes:
-                event_to_output = {"time":[0, duration, tempo], "content":[midi, pitch, 80 ,duration]}
+                note_to_output = 0, ["midi", pitch, 80 ,duration]
             self.tobeheld_notes.append(pitch)
         elif duration==0 and offset>=0:
-            event_to_output = {"time":[offset, 1000, tempo], "content":[midi, pitch, velocity ,1000]}
+            note_to_output = offset, ["midi", pitch, velocity ,1000]
             self.tobeheld_notes.append(pitch)
-        return event_to_output
+        return note_to_output
 
     def new_slice(self, trig_mode="automatic"):
         events = []
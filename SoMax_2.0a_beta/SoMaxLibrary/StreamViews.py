@@ -152,10 +152,12 @@ class StreamView(object):
     def get_merged_activity(self, date, weighted=True):
         '''get merged activities of children'''
         weight_sum = float(reduce(lambda x, y: x+y.weight, self.atoms.values(), 0.0))
-        merged_activity = SequencedList()
+        activities = []
+        weights = []
         for atom in self.atoms.values():
-            w = atom.weight if weighted else 1.0
-            merged_activity = merged_activity + atom.get_activity(date).mul(w, 0)
+            activities.append(atom.get_activity(date))
+            weights.append(atom.weight if weighted else 1.0)
+        merged_activity = SequencedList.merge_many(activities, weights, 0)
         for merge_action in self.merge_actions:
             merged_activity = merge_action.merge(merged_activity)
         return merged_activity
@@ -1,58 +1,165 @@
-import bisect
 import numpy as np
+import threading
 from collections import OrderedDict
-from copy import deepcopy
 
-# implementing the basic representation of a memory ordered by time
+# implementing the basic representation of a memory ordered by time.
+#   dates are stored in a contiguous float64 array and events in a parallel
+#   object array ; both are over-allocated and grown by doubling, so that
+#   appends are amortised O(1) and inserts only shift memory in numpy.
 class SequencedList(list):
+    min_capacity = 16
+
     def __init__(self, dates=[], events=[]):
-        if type(dates)!=list or type(events)!=list:
+        if not isinstance(dates, (list, tuple, np.ndarray)) or not isinstance(events, (list, tuple, np.ndarray)):
             raise TypeError("SequencedList has to be initialized with two lists")
         m = min(len(dates), len(events))
-        self.orderedDateList = dates[0:m]
-        self.orderedEventList = events[0:m]
+        self._size = 0
+        self._dates = np.empty(0, dtype=float)
+        self._events = np.empty(0, dtype=object)
+        self._reserve(m)
+        self._dates[0:m] = dates[0:m]
+        self._events[0:m] = object_array(events[0:m])
+        self._size = m
 
     def __repr__(self):
-        return reduce(lambda  x, y: x + str(self.orderedDateList[y])+": "+str(self.orderedEventList[y])+ " ; ", range(len(self.orderedDateList)), "")
+        return reduce(lambda  x, y: x + str(self._dates[y])+": "+str(self._events[y])+ " ; ", range(self._size), "")
 
-    def __getitem__(self, b):
-        if b >= len(self.orderedDateList):
+    # columns accessors, returning views on the used part of the buffers
+    @property
+    def orderedDateList(self):
+        return self._dates[0:self._size]
+
+    @orderedDateList.setter
+    def orderedDateList(self, dates):
+        m = len(dates)
+        self._reserve(m)
+        self._dates[0:m] = dates
+        self._size = m
+
+    @property
+    def orderedEventList(self):
+        return self._events[0:self._size]
+
+    @orderedEventList.setter
+    def orderedEventList(self, events):
+        m = len(events)
+        self._reserve(m)
+        self._events[0:m] = object_array(events)
+        self._size = m
+
+    def _reserve(self, capacity):
+        if capacity <= len(self._dates):
+            return
+        capacity = max(capacity, 2*len(self._dates), self.min_capacity)
+        dates = np.empty(capacity, dtype=float)
+        events = np.empty(capacity, dtype=object)
+        dates[0:self._size] = self._dates[0:self._size]
+        events[0:self._size] = self._events[0:self._size]
+        self._dates, self._events = dates, events
+
+    def _index(self, b):
+        if b < 0:
+            b += self._size
+        if b < 0 or b >= self._size:
             raise IndexError("list index out of range")
-        return self.orderedDateList[b], self.orderedEventList[b]
+        return b
+
+    def __getitem__(self, b):
+        if type(b)==slice:
+            return self.__getslice__(b.start, b.stop)
+        b = self._index(b)
+        return float(self._dates[b]), self._events[b]
     def __delitem__(self, b):
-        if b >= len(self.orderedDateList):
-            raise IndexError("list index out of range")
-        del self.orderedDateList[b]
-        del self.orderedEventList[b]
+        b = self._index(b)
+        n = self._size
+        self._dates[b:n-1] = self._dates[b+1:n]
+        self._events[b:n-1] = self._events[b+1:n]
+        self._events[n-1] = None
+        self._size -= 1
     def __setitem__(self, i, b):
-        self.orderedDateList[i] = b[0]
-        self.orderedEventList[i] = b[1]
+        i = self._index(i)
+        self._dates[i] = b[0]
+        self._events[i] = b[1]
     def __getslice__(self, b,c):
+        b, c, _ = slice(b, c).indices(self._size)
         result = SequencedList()
-        result.orderedEventList = list(self.orderedEventList[b:c])
-        result.orderedDateList = list(self.orderedDateList[b:c])
+        if c > b:
+            result._reserve(c-b)
+            result._dates[0:c-b] = self._dates[b:c]
+            result._events[0:c-b] = self._events[b:c]
+            result._size = c-b
         return result
 
     def __delslice__(self,b,c):
-        if b >= len(self.orderedDateList) or c >= len(self.orderedDateList):
+        if b >= self._size or c >= self._size:
             raise IndexError("list index out of range")
-        del self.orderedDateList[b:c]
-        del self.orderedEventList[b:c]
+        b, c, _ = slice(b, c).indices(self._size)
+        if c <= b:
+            return
+        n = self._size
+        self._dates[b:n-(c-b)] = self._dates[c:n]
+        self._events[b:n-(c-b)] = self._events[c:n]
+        self._events[n-(c-b):n] = None
+        self._size -= c-b
 
     def __len__(self):
-        return len(self.orderedDateList)
+        return self._size
     def __iter__(self):
-        return zip(self.orderedDateList, self.orderedEventList).__iter__()
+        return zip(self._dates[0:self._size].tolist(), self._events[0:self._size].tolist()).__iter__()
 
     def __add__(self, l):
+        if isinstance(l, SequencedList):
+            return SequencedList.merge_many([self, l])
         try:
-            new_list = SequencedList(self.orderedDateList, self.orderedEventList)
+            new_list = self[:]
             for date, event in l:
                 new_list.insert(date, event)
         except:
             raise TypeError("Trying to add SequencedList with object of type ", type(l))
         return new_list
 
+    @staticmethod
+    def merge_many(lists, weights=None, item=0):
+        '''merges k sequenced lists with a single stable sort over their dates.
+        if weights are given, the item-th element of each event of lists[i]
+        is multiplied by weights[i] while the events are gathered.'''
+        lists = list(lists)
+        if weights is None:
+            weights = [None]*len(lists)
+        elif len(weights)!=len(lists):
+            raise ValueError("merge_many needs one weight per list")
+        total = sum(map(len, lists))
+        result = SequencedList()
+        if total==0:
+            return result
+        dates = np.empty(total, dtype=float)
+        events = np.empty(total, dtype=object)
+        offset = 0
+        for l, w in zip(lists, weights):
+            n = len(l)
+            if n==0:
+                continue
+            if isinstance(l, WeightedSequencedList):
+                # weights of lazy views are folded in the current pass
+                if l.item==item:
+                    w = l.scalar if w is None else w*l.scalar
+                    l = l.base
+                else:
+                    l = l.materialise()
+            dates[offset:offset+n] = l.orderedDateList
+            if w is None or w==1.0:
+                events[offset:offset+n] = l.orderedEventList
+            else:
+                for j, e in enumerate(l.orderedEventList):
+                    events[offset+j] = e[:item] + (w*e[item],) + e[item+1:]
+            offset += n
+        order = np.argsort(dates, kind='mergesort')
+        result._reserve(total)
+        result._dates[0:total] = dates[order]
+        result._events[0:total] = events[order]
+        result._size = total
+        return result
+
     def mul(self, scalar, item=None):
         if item==None:
             return SequencedList(self.orderedDateList, map(lambda x: x*scalar, self.orderedEventList))
@@ -61,75 +168,237 @@ class SequencedList(list):
                 item = int(item)
             except:
                 raise TypeError("Item indictor for method mul must be an integer while it is ", type(item))
-            sql = SequencedList()
-            sql.orderedDateList = deepcopy(self.orderedDateList)
-            newEventList = deepcopy(self.orderedEventList)
-            for i in range(len(newEventList)):
-                newEventList[i] = list(newEventList[i])
-                newEventList[i][item] = scalar*newEventList[i][item]
-                newEventList[i] = tuple(newEventList[i])
-            sql.orderedEventList = newEventList
-            return sql
+            return WeightedSequencedList(self, scalar, item)
 
 
     def get_dates_list(self):
-        return list(self.orderedDateList)
+        return self._dates[0:self._size].tolist()
 
     def get_events_list(self):
-        return list(self.orderedEventList)
+        return self._events[0:self._size].tolist()
 
     def insert(self, date, state):
-        i = bisect.bisect_left(self.orderedDateList, date)
         try:
-            self.orderedDateList.insert(i, float(date))
-            self.orderedEventList.insert(i, state)
+            date = float(date)
         except:
             raise Exception("Could not append", state, "at dates", date)
+        n = self._size
+        i = int(np.searchsorted(self._dates[0:n], date, side='left'))
+        self._reserve(n+1)
+        self._dates[i+1:n+1] = self._dates[i:n]
+        self._events[i+1:n+1] = self._events[i:n]
+        self._dates[i] = date
+        self._events[i] = state
+        self._size += 1
         return i
 
     def append(self, date, state):
-        if len(self.orderedDateList):
-            if date<self.orderedDateList[-1]:
+        if self._size:
+            if date<self._dates[self._size-1]:
                 raise Exception("ERROR in Memory : trying to append a event that comes sooner")
-        self.orderedDateList.append(date)
-        self.orderedEventList.append(state)
+        self._reserve(self._size+1)
+        self._dates[self._size] = date
+        self._events[self._size] = state
+        self._size += 1
+
+    def extend(self, dates, states):
+        '''appends several events at once, dates being ordered'''
+        dates = np.asarray(dates, dtype=float)
+        n = min(len(dates), len(states))
+        if n==0:
+            return
+        dates = dates[0:n]
+        if np.any(np.diff(dates)<0) or (self._size and dates[0]<self._dates[self._size-1]):
+            raise Exception("ERROR in Memory : trying to append a event that comes sooner")
+        self._reserve(self._size+n)
+        self._dates[self._size:self._size+n] = dates
+        self._events[self._size:self._size+n] = object_array(states[0:n])
+        self._size += n
+
+    def clear(self):
+        self._dates = np.empty(0, dtype=float)
+        self._events = np.empty(0, dtype=object)
+        self._size = 0
+
+    def get_nearest(self, zetas):
+        '''batch nearest-event lookup. returns, for each date of zetas, the
+        index of the closest event (ties going to the earlier one) and its
+        distance ; dates beyond the last event get index -1 and distance nan.'''
+        zetas = np.atleast_1d(np.asarray(zetas, dtype=float))
+        n = self._size
+        if n==0:
+            return np.full(len(zetas), -1, dtype=int), np.full(len(zetas), np.nan)
+        dates = self._dates[0:n]
+        i = np.searchsorted(dates, zetas, side='left')
+        i_p = np.clip(i-1, 0, n-1)
+        i_n = np.minimum(i, n-1)
+        d_p = np.abs(zetas-dates[i_p])
+        d_n = np.abs(zetas-dates[i_n])
+        indices = np.where(d_p>d_n, i_n, i_p)
+        distances = np.minimum(d_p, d_n)
+        beyond = i>=n
+        indices[beyond] = -1
+        distances[beyond] = np.nan
+        return indices, distances
 
     def get_events(self, zeta_list):
-        if not len(self):
+        if not self._size:
             return [], []
-        if type(zeta_list)!=type(list()):
-            zeta_list = [zeta_list]
-        states = []
-        distances = []
-        for zeta in zeta_list:
-            i = bisect.bisect_left(list(self.orderedDateList), zeta)
-            if i>=len(self.orderedEventList):
-                states.append(None)
-                distances.append(None)
-            elif i<len(self.orderedEventList)-1 and i>0:
-                d_p = abs(zeta-self.orderedDateList[i-1])
-                d_n = abs(zeta-self.orderedDateList[i])
-                if d_p>d_n:
-                    states.append(self.orderedEventList[i])
-                    distances.append(d_n)
-                else:
-                    states.append(self.orderedEventList[i-1])
-                    distances.append(d_p)
-            elif i==len(self.orderedDateList)-1 or i==0:
-                d_p = abs(zeta-self.orderedDateList[i-1])
-                states.append(self.orderedEventList[i-1])
-                distances.append(d_p)
+        indices, distances = self.get_nearest(zeta_list)
+        states = [None if j<0 else self._events[j] for j in indices.tolist()]
+        distances = [None if j<0 else d for j, d in zip(indices.tolist(), distances.tolist())]
         return states, distances
 
+    def delete(self, indices):
+        '''removes the events at the given positions in one pass'''
+        keep = np.ones(self._size, dtype=bool)
+        keep[np.asarray(indices, dtype=int)] = False
+        m = int(np.count_nonzero(keep))
+        self._dates[0:m] = self._dates[0:self._size][keep]
+        self._events[0:m] = self._events[0:self._size][keep]
+        self._events[m:self._size] = None
+        self._size = m
+
     def truncate(self, zeta):
         try:
             zeta = float(zeta)
         except:
             raise TypeError("First argument must be convertible into float")
-        i_zeta = bisect.bisect_left(self.orderedDateList, zeta)
+        i_zeta = int(np.searchsorted(self._dates[0:self._size], zeta, side='left'))
         return self[0:i_zeta], self[i_zeta:]
 
 
+# read-only view over a SequencedList whose events are tuples, with their
+#   item-th element scaled by a scalar. the weight is applied lazily when the
+#   view is read, or folded into SequencedList.merge_many ; the underlying
+#   list is shared and never copied.
+class WeightedSequencedList(SequencedList):
+    def __init__(self, base, scalar=1.0, item=0):
+        if isinstance(base, WeightedSequencedList) and base.item==item:
+            scalar = scalar*base.scalar
+            base = base.base
+        elif isinstance(base, WeightedSequencedList):
+            base = base.materialise()
+        self.base = base
+        self.scalar = scalar
+        self.item = item
+
+    def __repr__(self):
+        return reduce(lambda x, y: x + str(y[0])+": "+str(y[1])+ " ; ", self, "")
+
+    def _weigh(self, e):
+        return e[:self.item] + (self.scalar*e[self.item],) + e[self.item+1:]
+
+    def _read_only(self, *args):
+        raise TypeError("WeightedSequencedList is a read-only view, call materialise() first")
+
+    insert = append = extend = clear = delete = __setitem__ = __delitem__ = __delslice__ = _read_only
+
+    @property
+    def orderedDateList(self):
+        return self.base.orderedDateList
+
+    @property
+    def orderedEventList(self):
+        return object_array(self.get_events_list())
+
+    def materialise(self):
+        return SequencedList(self.base.orderedDateList, self.get_events_list())
+
+    def __getitem__(self, b):
+        if type(b)==slice:
+            return self.__getslice__(b.start, b.stop)
+        date, event = self.base[b]
+        return date, self._weigh(event)
+    def __getslice__(self, b, c):
+        return WeightedSequencedList(self.base[b:c], self.scalar, self.item)
+
+    def __len__(self):
+        return len(self.base)
+    def __iter__(self):
+        return zip(self.base.get_dates_list(), self.get_events_list()).__iter__()
+
+    def mul(self, scalar, item=None):
+        if item!=None and int(item)==self.item:
+            return WeightedSequencedList(self.base, scalar*self.scalar, self.item)
+        return self.materialise().mul(scalar, item)
+
+    def get_dates_list(self):
+        return self.base.get_dates_list()
+
+    def get_events_list(self):
+        return map(self._weigh, self.base.get_events_list())
+
+    def get_nearest(self, zetas):
+        return self.base.get_nearest(zetas)
+
+    def get_events(self, zeta_list):
+        states, distances = self.base.get_events(zeta_list)
+        return [None if s is None else self._weigh(s) for s in states], distances
+
+    def truncate(self, zeta):
+        before, after = self.base.truncate(zeta)
+        return WeightedSequencedList(before, self.scalar, self.item), WeightedSequencedList(after, self.scalar, self.item)
+
+
+# bounded least-recently-used cache, counting its hits and misses. used as a
+#   flyweight store for objects that are costly to build and often requested
+#   again in a short time, such as the events played by a player.
+class LRUCache(object):
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.items[key] = value # most recently used last
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items)>self.capacity:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_metrics(self):
+        requests = self.hits+self.misses
+        return {"size":len(self.items), "capacity":self.capacity, "hits":self.hits, "misses":self.misses, \
+                "hit_rate":float(self.hits)/requests if requests else 0.0}
+
+
+# builds a one-dimensional object array without letting numpy unpack
+#   tuple or list elements into additional dimensions
+def object_array(seq):
+    if isinstance(seq, np.ndarray) and seq.dtype==object:
+        return seq
+    arr = np.empty(len(seq), dtype=object)
+    for i in xrange(len(seq)):
+        arr[i] = seq[i]
+    return arr
+
+
 
 # max activity need to be some param
 def scale_activity(activity):
@@ -1,6 +1,7 @@
 import Events
+import threading
+import numpy as np
 from numpy import roll
-from copy import deepcopy
 
 # abstract class that represents identity, only if the class of the object
 #       is in the transformation catalog
@@ -21,12 +22,24 @@ class NoTransform(object):
     def decode(self, thing):
         return thing
 
+    def encode_batch(self, values, label_type):
+        '''encodes at once an array of values of labels of type label_type'''
+        return get_batch_functions(self, label_type)[0](self, np.asarray(values))
+
+    def decode_batch(self, values, label_type):
+        '''decodes at once an array of values of labels of type label_type'''
+        return get_batch_functions(self, label_type)[1](self, np.asarray(values))
+
     def __eq__(self, a):
         if type(a)==type(self):
             return True
         else:
             return False
 
+    def get_key(self):
+        '''hashable key identifying the transform in the registry'''
+        return ('NoTransform',)
+
     @classmethod
     def get_transformation_patterns(cls):
         return [cls()]
@@ -47,52 +60,27 @@ class TransposeTransform(NoTransform):
         return 'TransposeTransform'
 
     def encode(self, thing):
-        if isinstance(thing, Events.AbstractEvent):
-            new_thing = deepcopy(thing)
-            new_thing.label = self.encode(new_thing.label)
-            new_thing.contents = self.encode(new_thing.contents)
-            return new_thing
-        if type(thing) is Events.MelodicLabel:
-            new_label = deepcopy(thing)
-            new_label.label+=self.semitone # pas precis : rajouter les bornes et les accords
-            return new_label
-        elif type(thing) is Events.HarmonicLabel:
-            chromas = list(thing.chroma)
-            new_label = Events.HarmonicLabel(roll(thing.chroma, self.semitone))
-        elif type(thing) is Events.ClassicMIDIContents:
-            new_content = deepcopy(thing)
-            for u in new_content.contents["notes"]:
-                u["pitch"]+=float(self.semitone)
-            return new_content
-        elif type(thing) is Events.ClassicAudioContents:
-            new_content = deepcopy(thing)
-            new_content.transpose+=float(self.semitone*100.0)
-            return new_content
-        else:
-            raise TransformError(thing, self)
+        return self.transpose(thing, self.semitone)
 
     def decode(self, thing):
+        return self.transpose(thing, -self.semitone)
+
+    def transpose(self, thing, semitone):
+        '''returns a transposed copy of thing, sharing what is unchanged'''
         if isinstance(thing, Events.AbstractEvent):
-            new_thing = deepcopy(thing)
-            new_thing.label = self.decode(new_thing.label)
-            new_thing.contents = self.decode(new_thing.contents)
-            return new_thing
+            return thing.replace(label=self.transpose(thing.label, semitone), contents=self.transpose(thing.contents, semitone))
         if type(thing) is Events.MelodicLabel:
-            new_label = deepcopy(thing)
-            new_label.label-=self.semitone # pas precis : rajouter les bornes et les accords
-            return new_label
+            return thing.replace(label=thing.label+semitone) # pas precis : rajouter les bornes et les accords
         elif type(thing) is Events.HarmonicLabel:
-            chromas = list(thing.chroma)
-            new_label = Events.HarmonicLabel(roll(thing.chroma, -self.semitone))
+            new_label = Events.HarmonicLabel(roll(thing.chroma, semitone))
+            return new_label
         elif type(thing) is Events.ClassicMIDIContents:
-            new_content = deepcopy(thing)
-            for u in new_content.contents["notes"]:
-                u["pitch"]-=float(self.semitone)
-            return new_content
+            # only the pitch row changes, the contents dictionary is shared
+            notes = thing.notes.copy()
+            notes[thing.PITCH] += semitone
+            return thing.replace(notes=notes)
         elif type(thing) is Events.ClassicAudioContents:
-            new_content = deepcopy(thing)
-            new_content.transpose-=float(self.semitone*100)
-            return new_content
+            return thing.replace(transpose=thing.transpose+float(semitone*100.0))
         else:
             raise TransformError(thing, self)
 
@@ -107,6 +95,11 @@ class TransposeTransform(NoTransform):
         else:
             return False
 
+    def get_key(self):
+        if self.semitone==0:
+            return NoTransform.get_key(self)
+        return ('TransposeTransform', self.semitone)
+
     @classmethod
     def get_transformation_patterns(cls, r=None):
         r = r if r!=None else TransposeTransform.transposition_range
@@ -126,3 +119,71 @@ class TransformError(Exception):
         self.transform = transform
     def __str__(self):
         return "Couldn't apply "+str(type(self.transform))+" on object "+str(type(self.thing))
+
+
+###############################################################################
+# TransformRegistry interns every transform used by the system to a small
+#   integer ID. activity profiles only carry these IDs, so that merging and
+#   comparing peaks are integer operations ; transform objects are fetched
+#   back from the registry when an event is actually decoded.
+
+class TransformRegistry(object):
+    def __init__(self):
+        # the identity is always registered first, and instantiated lazily
+        #   as Events may not be fully imported yet
+        self.transforms = [None]
+        self.ids = {('NoTransform',): 0}
+        self.lock = threading.Lock()
+
+    def get_id(self, transform):
+        key = transform.get_key()
+        try:
+            return self.ids[key]
+        except KeyError:
+            with self.lock:
+                if not key in self.ids:
+                    self.transforms.append(transform)
+                    self.ids[key] = len(self.transforms)-1
+                return self.ids[key]
+
+    def get_transform(self, transform_id):
+        transform = self.transforms[int(transform_id)]
+        if transform is None:
+            transform = self.transforms[int(transform_id)] = NoTransform()
+        return transform
+
+registry = TransformRegistry()
+
+def get_transform_id(transform):
+    return registry.get_id(transform)
+
+def get_transform(transform_id):
+    return registry.get_transform(transform_id)
+
+NO_TRANSFORM = 0
+
+
+###############################################################################
+# batch functions transform at once arrays of label values, as given by
+#   label_type.get_values : pitches for melodic labels, (n x 12) chromas for
+#   harmonic labels. a whole influence buffer, or a whole corpus column, is then
+#   transformed in one call. they are registered per transform class and name
+#   of label type, as Events is not fully imported yet when this module is ;
+#   label types inherit the batch functions of their parents.
+
+batch_functions = dict()
+
+def register_batch(transform_type, label_type, encode, decode):
+    label_name = label_type if type(label_type)==str else label_type.__name__
+    batch_functions[(transform_type, label_name)] = (encode, decode)
+
+def get_batch_functions(transform, label_type):
+    for cls in label_type.__mro__:
+        if (type(transform), cls.__name__) in batch_functions:
+            return batch_functions[(type(transform), cls.__name__)]
+    raise TransformError(label_type, transform)
+
+register_batch(NoTransform, "AbstractLabel", lambda t, values: values, lambda t, values: values)
+register_batch(TransposeTransform, "MelodicLabel", lambda t, values: values+t.semitone, lambda t, values: values-t.semitone)
+register_batch(TransposeTransform, "HarmonicLabel", lambda t, values: roll(values, t.semitone, axis=-1), \
+                lambda t, values: roll(values, -t.semitone, axis=-1))
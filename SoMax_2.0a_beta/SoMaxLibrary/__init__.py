@@ -28,7 +28,7 @@ TRANSFORM_TYPES = [Transforms.NoTransform, Transforms.TransposeTransform]
 LABEL_TYPES = [Events.MelodicLabel, Events.HarmonicLabel]
 CONTENTS_TYPES = [Events.ClassicMIDIContents, Events.ClassicAudioContents]
 EVENT_TYPES = [Events.AbstractEvent]
-MEMORY_TYPES = [MemorySpaces.NGramMemorySpace]
+MEMORY_TYPES = [MemorySpaces.NGramMemorySpace, MemorySpaces.SuffixAutomatonMemorySpace, MemorySpaces.ChromaMemorySpace, MemorySpaces.SegmentedMemorySpace]
 
 '''reload(ActivityPatterns)
 reload(MemorySpaces)